@@ -0,0 +1,132 @@
+# Parity check and benchmark for the CLIP inference backends.
+#
+#   python -m benchmarks.clip_backends --backends torch,torch-int8,onnx --images ./images
+#
+# Every backend's image and text embeddings are compared with eager PyTorch by cosine
+# similarity, and batch latency and throughput are reported per backend. The exit status
+# is non-zero if any backend's minimum cosine similarity falls below --min-cosine.
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+from inference_backends import BACKENDS, configure_threads, create_backend
+from model_registry import CLIP_MODEL_NAME, get_clip
+
+TEXTS = [
+    "a pink summer t-shirt",
+    "black trousers for casual wear",
+    "comfortable blue pants",
+    "a stylish women's t-shirt with a long cut",
+]
+
+
+def load_images(folder, count, seed=0):
+    paths = sorted(glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.png"))) if folder else []
+    images = [Image.open(path).convert("RGB") for path in paths[:count]]
+    # Pad with deterministic noise images so the benchmark also runs without a catalog
+    rng = np.random.default_rng(seed)
+    while len(images) < count:
+        images.append(Image.fromarray(rng.integers(0, 256, (320, 320, 3), dtype=np.uint8)))
+    return images
+
+
+def cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def time_batches(fn, batches, iterations):
+    fn(batches[0])
+    latencies = []
+    for _ in range(iterations):
+        for batch in batches:
+            start = time.perf_counter()
+            fn(batch)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(args):
+    configure_threads(args.threads)
+    model, processor = get_clip(args.model)
+    images = load_images(args.images, args.num_images)
+    image_inputs = processor(images=images, return_tensors="np")["pixel_values"]
+    text_inputs = processor(text=TEXTS, return_tensors="np", padding=True)
+    batches = [image_inputs[i:i + args.batch_size] for i in range(0, len(image_inputs), args.batch_size)]
+
+    reference = create_backend("torch", model, args.model)
+    reference_images = reference.image_features(image_inputs)
+    reference_texts = reference.text_features(text_inputs["input_ids"], text_inputs["attention_mask"])
+
+    results = []
+    for name in args.backends:
+        start = time.perf_counter()
+        backend = reference if name == "torch" else create_backend(name, model, args.model, num_threads=args.threads)
+        setup = time.perf_counter() - start
+
+        image_cos = cosine(reference_images, backend.image_features(image_inputs))
+        text_cos = cosine(reference_texts, backend.text_features(text_inputs["input_ids"], text_inputs["attention_mask"]))
+        latencies = time_batches(backend.image_features, batches, args.iterations)
+
+        results.append({
+            "backend": name,
+            "setup_seconds": setup,
+            "batch_size": args.batch_size,
+            "image_cosine_min": float(image_cos.min()),
+            "image_cosine_mean": float(image_cos.mean()),
+            "text_cosine_min": float(text_cos.min()),
+            "text_cosine_mean": float(text_cos.mean()),
+            "latency_p50_ms": statistics.median(latencies) * 1000,
+            "latency_max_ms": max(latencies) * 1000,
+            "images_per_sec": args.iterations * len(image_inputs) / sum(latencies),
+        })
+
+    baseline = next((r["images_per_sec"] for r in results if r["backend"] == "torch"), None)
+    print(f"{'backend':<12}{'img/s':>10}{'speedup':>10}{'p50 ms':>10}{'img cos min':>14}{'txt cos min':>14}")
+    for r in results:
+        speedup = r["images_per_sec"] / baseline if baseline else float("nan")
+        r["speedup_vs_torch"] = speedup
+        print(f"{r['backend']:<12}{r['images_per_sec']:>10.1f}{speedup:>10.2f}{r['latency_p50_ms']:>10.1f}"
+              f"{r['image_cosine_min']:>14.4f}{r['text_cosine_min']:>14.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "results": results}, f, indent=2)
+
+    failed = [r["backend"] for r in results
+              if min(r["image_cosine_min"], r["text_cosine_min"]) < args.min_cosine]
+    if failed:
+        print(f"Parity check failed (min cosine < {args.min_cosine}): {', '.join(failed)}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CLIP inference backends against eager PyTorch")
+    parser.add_argument("--backends", default="torch,torch-int8,onnx",
+                        type=lambda value: [name for name in value.split(",") if name])
+    parser.add_argument("--model", default=CLIP_MODEL_NAME)
+    parser.add_argument("--images", default="./images", help="folder of .jpg/.png files; padded with noise images")
+    parser.add_argument("--num-images", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
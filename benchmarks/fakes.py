@@ -0,0 +1,216 @@
+# Latency-configurable stand-ins for the services the API talks to, so the benchmarks
+# run without Qdrant, Gemini, a speech service or downloaded CLIP weights.
+import asyncio
+import json
+import random
+import threading
+import time
+import zlib
+import numpy as np
+from PIL import Image
+from qdrant_client import QdrantClient
+
+from ingest import VectorIngestor
+from preprocess import CLIP_IMAGE_SIZE, CLIP_MEAN, CLIP_STD
+from voice import StaticRecognizerBackend
+
+
+class Latency:
+    # Gaussian delay in milliseconds, clipped at zero; Latency(0) never sleeps
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0, seed=0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self, scale=1.0):
+        if self.mean_ms <= 0:
+            return
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.mean_ms, self.jitter_ms))
+        time.sleep(delay * scale / 1000)
+
+
+class LatencyProxy:
+    # Wraps any client and sleeps before each call to one of `methods` (all methods if None)
+    def __init__(self, target, latency, methods=None):
+        self._target = target
+        self._latency = latency
+        self._methods = set(methods) if methods is not None else None
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or (self._methods is not None and name not in self._methods):
+            return attr
+
+        def call(*args, **kwargs):
+            self._latency.sleep()
+            return attr(*args, **kwargs)
+        return call
+
+
+QDRANT_NETWORK_METHODS = ("get_collection", "create_collection", "upload_collection", "upsert", "scroll", "search", "delete")
+
+
+# Qdrant's local in-memory mode behind a simulated network round trip
+def fake_qdrant_client(latency=None):
+    return LatencyProxy(QdrantClient(":memory:"), latency or Latency(), QDRANT_NETWORK_METHODS)
+
+
+class FakeClipProcessor:
+    # Produces inputs with the same shapes and dtypes as CLIPProcessor(return_tensors="np")
+    VOCAB_SIZE = 49408
+
+    def __call__(self, text=None, images=None, return_tensors="np", padding=True, truncation=True):
+        inputs = {}
+        if images is not None:
+            images = images if isinstance(images, list) else [images]
+            inputs["pixel_values"] = np.stack([self._pixels(image) for image in images])
+        if text is not None:
+            tokens = [[zlib.crc32(word.encode()) % self.VOCAB_SIZE for word in t.lower().split()] or [0] for t in text]
+            width = max(len(t) for t in tokens)
+            inputs["input_ids"] = np.array([t + [0] * (width - len(t)) for t in tokens], dtype=np.int64)
+            inputs["attention_mask"] = np.array([[1] * len(t) + [0] * (width - len(t)) for t in tokens], dtype=np.int64)
+        return inputs
+
+    @staticmethod
+    def _pixels(image):
+        image = image.convert("RGB").resize((CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE), Image.BILINEAR)
+        return ((np.asarray(image, dtype=np.float32) / 255.0 - CLIP_MEAN) / CLIP_STD).transpose(2, 0, 1)
+
+
+class FakeClipBackend:
+    # Deterministic embeddings from a fixed random projection, with a simulated model cost
+    # of `latency` per call plus `per_item` per row
+    name = "fake"
+
+    def __init__(self, dim=512, latency=None, per_item=None, seed=0):
+        self.dim = dim
+        self.latency = latency or Latency()
+        self.per_item = per_item or Latency()
+        rng = np.random.default_rng(seed)
+        self._image_projection = rng.standard_normal((3 * 8 * 8, dim)).astype(np.float32)
+        self._token_projection = rng.standard_normal((1024, dim)).astype(np.float32)
+
+    def image_features(self, pixel_values):
+        pixel_values = np.asarray(pixel_values, dtype=np.float32)
+        self._wait(len(pixel_values))
+        n = len(pixel_values)
+        pooled = pixel_values.reshape(n, 3, 8, pixel_values.shape[2] // 8, 8, pixel_values.shape[3] // 8).mean(axis=(3, 5))
+        return pooled.reshape(n, -1) @ self._image_projection
+
+    def text_features(self, input_ids, attention_mask):
+        input_ids = np.asarray(input_ids)
+        self._wait(len(input_ids))
+        mask = np.asarray(attention_mask, dtype=np.float32)[..., None]
+        return (self._token_projection[input_ids % len(self._token_projection)] * mask).sum(axis=1)
+
+    def _wait(self, rows):
+        self.latency.sleep()
+        self.per_item.sleep(rows)
+
+
+# VectorIngestor with its CLIP towers and Qdrant client swapped for stand-ins. The
+# pipelined ingest path preprocesses with preprocess.py, so no CLIP weights are needed.
+def fake_clip_ingestor_class(client, backend=None, processor=None):
+    backend = backend or FakeClipBackend(VectorIngestor.VECTOR_SIZE)
+    processor = processor or FakeClipProcessor()
+
+    class FakeClipIngestor(VectorIngestor):
+        def __init__(self, image_folder, **kwargs):
+            kwargs.setdefault("client", client)
+            kwargs.setdefault("cache_dir", None)
+            super().__init__(image_folder, **kwargs)
+
+        @property
+        def model(self):
+            return None
+
+        @property
+        def processor(self):
+            return processor
+
+        @property
+        def backend(self):
+            return backend
+
+    return FakeClipIngestor
+
+
+# Real CLIP towers, stand-in Qdrant
+def real_clip_ingestor_class(client):
+    class RealClipIngestor(VectorIngestor):
+        def __init__(self, image_folder, **kwargs):
+            kwargs.setdefault("client", client)
+            kwargs.setdefault("cache_dir", None)
+            super().__init__(image_folder, **kwargs)
+
+    return RealClipIngestor
+
+
+class FakeAssistant:
+    # Same surface main.py uses from AIVoiceAssistant. The LLM call costs `latency`, and
+    # streamed answers additionally cost `token_latency` per token.
+    RESPONSE = "Here are a few items from the catalog that match what you asked for."
+
+    def __init__(self, vector_db_url=None, api_key=None, client=None, collection_name="image_vectors", embed=None,
+                 latency=None, token_latency=None, limit=5):
+        self.client = client
+        self.collection_name = collection_name
+        self.embed = embed
+        self.latency = latency or Latency()
+        self.token_latency = token_latency or Latency()
+        self.limit = limit
+
+    def query_vector_db(self, query_text):
+        if self.client is None or self.embed is None:
+            return []
+        return self.client.search(collection_name=self.collection_name, query_vector=list(map(float, self.embed(query_text))),
+                                  limit=self.limit, with_payload=True)
+
+    def generate_response(self, query_text, action_result=None):
+        self.latency.sleep()
+        return self.RESPONSE
+
+    def generate_response_stream(self, query_text, action_result=None):
+        self.latency.sleep()
+        for word in self.RESPONSE.split():
+            self.token_latency.sleep()
+            yield word + " "
+
+    def handle_user_query(self, query_text):
+        return self.generate_response(query_text)
+
+
+class FakeRecognizerBackend(StaticRecognizerBackend):
+    # StaticRecognizerBackend plus a simulated recognition round trip
+    def __init__(self, transcript="show me a pink t-shirt", latency=None):
+        super().__init__(transcript)
+        self.latency = latency or Latency()
+
+    def recognize(self, audio):
+        self.latency.sleep()
+        return super().recognize(audio)
+
+
+class FakeWebSocket:
+    # Enough of starlette's WebSocket for ConnectionManager. Messages that carry a
+    # "sent_at" perf_counter timestamp record their end-to-end delivery latency.
+    def __init__(self, latency=None, seed=0):
+        self.latency = latency or Latency()
+        self.delivery_latencies = []
+        self.closed = False
+        self._random = random.Random(seed)
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        if self.latency.mean_ms > 0:
+            await asyncio.sleep(max(0.0, self._random.gauss(self.latency.mean_ms, self.latency.jitter_ms)) / 1000)
+        sent_at = json.loads(message).get("sent_at")
+        if sent_at is not None:
+            self.delivery_latencies.append(time.perf_counter() - sent_at)
+
+    async def close(self, code=1000):
+        self.closed = True
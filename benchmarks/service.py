@@ -0,0 +1,378 @@
+# Offline load tests and micro-benchmarks for the service's hot paths.
+#
+#   python -m benchmarks.service --scenarios query,ingest,voice,ws,extract,batch_ingest
+#
+# Qdrant, the LLM and the speech recognizer are replaced by the latency-configurable
+# stand-ins in benchmarks/fakes.py. CLIP is faked too unless --clip real is given, in
+# which case the weights must already be in the local Hugging Face cache. HTTP scenarios
+# drive main.app in process through httpx's ASGI transport. Every scenario reports
+# throughput, p50/p95/p99 latency and RSS, and the whole run is written as JSON to
+# --output so results can be compared between commits.
+import argparse
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import types
+import uuid
+import wave
+import numpy as np
+from PIL import Image
+
+from benchmarks.fakes import (
+    FakeAssistant, FakeClipBackend, FakeRecognizerBackend, FakeWebSocket, Latency,
+    fake_clip_ingestor_class, fake_qdrant_client, real_clip_ingestor_class,
+)
+
+SCENARIOS = ("query", "ingest", "voice", "ws", "extract", "batch_ingest")
+
+QUERIES = [
+    "show me a pink summer t-shirt",
+    "black trousers for casual wear",
+    "comfortable blue pants under $50",
+    "t-shirts between 20 and 80",
+    "add to cart the pink t-shirt",
+    "provide me discount",
+]
+
+
+def summarize(latencies, elapsed, errors=0):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+    return {
+        "count": int(len(latencies)),
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "throughput_per_sec": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(latencies.max()) if len(latencies) else 0.0,
+    }
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def synthetic_jpeg(seed, size=(480, 640)):
+    rng = np.random.default_rng(seed)
+    image = Image.fromarray(rng.integers(0, 256, (*size, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def write_images(folder, count, offset=0):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"bench_{offset + i}.jpg")
+        with open(path, "wb") as f:
+            f.write(synthetic_jpeg(offset + i))
+        paths.append(path)
+    return paths
+
+
+def silent_wav(seconds=1.0, sample_rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\0\0" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def ingestor_class(args, client):
+    if args.clip == "real":
+        return real_clip_ingestor_class(client)
+    backend = FakeClipBackend(latency=Latency(args.clip_ms, args.clip_ms / 4), per_item=Latency(args.clip_item_ms))
+    return fake_clip_ingestor_class(client, backend)
+
+
+def seed_catalog(ingestor, size, seed=0):
+    ingestor.schema.ensure(ingestor.client, ingestor.collection_name)
+    rng = np.random.default_rng(seed)
+    ingestor.client.upload_collection(
+        collection_name=ingestor.collection_name,
+        vectors=rng.standard_normal((size, ingestor.VECTOR_SIZE)).astype(np.float32),
+        payload=[{"id": str(uuid.UUID(int=i)), "file_name": f"item_{i}.jpg", "description": f"catalog item {i}",
+                  "price": float(rng.integers(5, 200))} for i in range(size)],
+        ids=[str(uuid.UUID(int=i)) for i in range(size)],
+    )
+
+
+# Imports main.py against the stand-ins. Runs inside the scratch directory, since main
+# mounts ./images and writes uploads there.
+def load_service(args):
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ.setdefault("VOICE_RECOGNIZER", "static")
+    os.environ.setdefault("CART_BACKEND", "memory")
+
+    client = fake_qdrant_client(Latency(args.qdrant_ms, args.qdrant_ms / 4))
+    import ingest
+    ingest.VectorIngestor = ingestor_class(args, client)
+    if importlib.util.find_spec("app") is None:
+        # app.py holds the Gemini assistant and isn't needed offline
+        sys.modules["app"] = types.SimpleNamespace(AIVoiceAssistant=FakeAssistant)
+    import main
+
+    seed_catalog(main.ingestor, args.catalog_size)
+    if main.vector_index is not None:
+        main.vector_index.load_from_qdrant(main.ingestor.client, main.ingestor.collection_name)
+    main.assistant = FakeAssistant(
+        client=client, embed=main.ingestor.extract_text_features,
+        latency=Latency(args.llm_ms, args.llm_ms / 4), token_latency=Latency(args.token_ms),
+    )
+    main.voice_pipeline.backend = FakeRecognizerBackend(latency=Latency(args.stt_ms, args.stt_ms / 4))
+    main.ready = True
+    return main
+
+
+async def drive(send, total, concurrency):
+    latencies = []
+    errors = 0
+    pending = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in pending:
+            start = time.perf_counter()
+            try:
+                response = await send(i)
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def http_client(main):
+    import httpx
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark", timeout=60.0)
+
+
+async def bench_query(args, main):
+    async with http_client(main) as http:
+        async def send(i):
+            headers = {"X-Session-Id": f"bench-{i % args.sessions}"}
+            return await http.post("/query/", json={"query_text": QUERIES[i % len(QUERIES)]}, headers=headers)
+        return await drive(send, args.requests, args.concurrency)
+
+
+async def bench_ingest(args, main):
+    job_ids = []
+    async with http_client(main) as http:
+        async def send(i):
+            files = [("files", (f"upload_{i}_{j}.jpg", synthetic_jpeg(10_000 + i * args.ingest_batch + j), "image/jpeg"))
+                     for j in range(args.ingest_batch)]
+            response = await http.post("/ingest/", files=files)
+            if response.status_code == 202:
+                job_ids.append(response.json()["job_id"])
+            return response
+
+        start = time.perf_counter()
+        result = await drive(send, args.ingest_requests, min(args.concurrency, args.ingest_requests))
+        statuses = {}
+        for job_id in job_ids:
+            while True:
+                status = (await http.get(f"/ingest/{job_id}")).json()["status"]
+                if status not in ("queued", "running"):
+                    break
+                await asyncio.sleep(0.02)
+            statuses[status] = statuses.get(status, 0) + 1
+        elapsed = time.perf_counter() - start
+
+    images = len(job_ids) * args.ingest_batch
+    result.update({"jobs": statuses, "images": images, "job_seconds": elapsed,
+                   "images_per_sec": images / elapsed if elapsed > 0 else 0.0})
+    return result
+
+
+async def bench_voice(args, main):
+    audio = silent_wav()
+    async with http_client(main) as http:
+        async def send(i):
+            return await http.post("/voice-query", files={"file": ("query.wav", audio, "audio/wav")})
+        return await drive(send, args.requests, args.concurrency)
+
+
+async def bench_ws(args):
+    from connection_manager import ConnectionManager
+    manager = ConnectionManager(queue_size=args.ws_queue_size, overflow=args.ws_overflow)
+    sockets = []
+    for i in range(args.ws_connections):
+        socket = FakeWebSocket(Latency(args.ws_send_ms, args.ws_send_ms / 4), seed=i)
+        await manager.connect(socket, room=f"room-{i % args.ws_rooms}")
+        sockets.append(socket)
+
+    start = time.perf_counter()
+    for n in range(args.ws_messages):
+        for room in range(args.ws_rooms):
+            message = json.dumps({"action": "edit", "n": n, "sent_at": time.perf_counter()})
+            await manager.send_message(message, room=f"room-{room}", coalesce_key="edit")
+        await asyncio.sleep(0)
+    while manager.stats()["queue_depth_total"] and time.perf_counter() - start < 60:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+
+    stats = manager.stats()
+    for socket in sockets:
+        manager.disconnect(socket)
+    result = summarize([latency for socket in sockets for latency in socket.delivery_latencies], elapsed)
+    result.update({"connections": args.ws_connections, "rooms": args.ws_rooms,
+                   "dropped": stats["messages_dropped"], "send_errors": stats["send_errors"]})
+    return result
+
+
+def bench_extract(args, workdir, client):
+    ingestor = ingestor_class(args, client)(os.path.join(workdir, "images"))
+    paths = write_images(os.path.join(workdir, "extract"), args.images)
+    ingestor.extract_features(paths[0])
+    latencies = []
+    start = time.perf_counter()
+    for path in paths:
+        t = time.perf_counter()
+        ingestor.extract_features(path)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_batch_ingest(args, workdir, client):
+    ingestor = ingestor_class(args, client)(os.path.join(workdir, "images"), decode_workers=args.decode_workers)
+    paths = write_images(os.path.join(workdir, "batch"), args.images, offset=1_000_000)
+    images = [{"file_name": os.path.relpath(path, ingestor.image_folder), "description": "benchmark image", "price": 10.0}
+              for path in paths]
+    latencies = []
+    inserted = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(args.iterations):
+            t = time.perf_counter()
+            inserted += ingestor.create_vector_db(images)["inserted"]
+            latencies.append(time.perf_counter() - t)
+    finally:
+        ingestor.shutdown()
+    elapsed = time.perf_counter() - start
+    result = summarize(latencies, elapsed)
+    result.update({"images_per_sec": inserted / elapsed if elapsed > 0 else 0.0, "batch_size": ingestor.batch_size,
+                   "decode_workers": args.decode_workers})
+    return result
+
+
+# Everything runs on one event loop: main.py creates its asyncio primitives at import
+async def run_scenarios(args, workdir):
+    results = {}
+    main = None
+    for name in args.scenarios:
+        rss_before = rss_mb()
+        try:
+            if name in ("query", "ingest", "voice"):
+                main = main or load_service(args)
+                result = await {"query": bench_query, "ingest": bench_ingest, "voice": bench_voice}[name](args, main)
+            elif name == "ws":
+                result = await bench_ws(args)
+            else:
+                client = fake_qdrant_client(Latency(args.qdrant_ms, args.qdrant_ms / 4))
+                result = (bench_extract if name == "extract" else bench_batch_ingest)(args, workdir, client)
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        result.update({"rss_before_mb": rss_before, "rss_after_mb": rss_mb(), "peak_rss_mb": peak_rss_mb()})
+        results[name] = result
+        if "error" in result:
+            print(f"{name:<14}error: {result['error']}")
+        else:
+            print(f"{name:<14}{result['throughput_per_sec']:>10.1f}/s  p50 {result['p50_ms']:>8.1f}ms  "
+                  f"p95 {result['p95_ms']:>8.1f}ms  p99 {result['p99_ms']:>8.1f}ms  errors {result['errors']}  "
+                  f"rss {result['rss_after_mb'] or 0:.0f}MB")
+    return results
+
+
+def run(args):
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(os.path.join(workdir, "images"))
+    os.chdir(workdir)
+    results = asyncio.run(run_scenarios(args, workdir))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if any("error" in result for result in results.values()) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load tests and micro-benchmarks for the API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [name for name in value.split(",") if name])
+    parser.add_argument("--clip", choices=("fake", "real"), default="fake")
+    parser.add_argument("--output", default="benchmark_results.json", help="write results as JSON")
+
+    load = parser.add_argument_group("HTTP load")
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--sessions", type=int, default=8)
+    load.add_argument("--catalog-size", type=int, default=1000)
+    load.add_argument("--ingest-requests", type=int, default=10)
+    load.add_argument("--ingest-batch", type=int, default=8, help="images per /ingest/ request")
+
+    latency = parser.add_argument_group("stand-in latencies (ms)")
+    latency.add_argument("--qdrant-ms", type=float, default=2.0)
+    latency.add_argument("--llm-ms", type=float, default=50.0)
+    latency.add_argument("--token-ms", type=float, default=0.0)
+    latency.add_argument("--stt-ms", type=float, default=100.0)
+    latency.add_argument("--clip-ms", type=float, default=5.0, help="per fake CLIP call")
+    latency.add_argument("--clip-item-ms", type=float, default=2.0, help="per image or text in a fake CLIP call")
+
+    micro = parser.add_argument_group("ingest micro-benchmarks")
+    micro.add_argument("--images", type=int, default=64)
+    micro.add_argument("--iterations", type=int, default=3)
+    micro.add_argument("--decode-workers", type=int, default=0)
+
+    ws = parser.add_argument_group("WebSocket broadcast")
+    ws.add_argument("--ws-connections", type=int, default=200)
+    ws.add_argument("--ws-rooms", type=int, default=20)
+    ws.add_argument("--ws-messages", type=int, default=50, help="messages per room")
+    ws.add_argument("--ws-send-ms", type=float, default=1.0)
+    ws.add_argument("--ws-queue-size", type=int, default=100)
+    ws.add_argument("--ws-overflow", default="drop_oldest")
+
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
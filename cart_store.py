@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DISCOUNT = {"current_discount": 10, "max_discount": 20, "bargaining_attempts": 0}
+BARGAIN_STEP = 2
+
+
+def product_key(item):
+    # Search results without a stored point id come back as "unknown_id"; fall back to the description
+    item_id = str(item.get("id") or "")
+    if item_id and item_id != "unknown_id":
+        return item_id
+    return f"desc:{description_key(item['description'])}"
+
+
+def description_key(description):
+    return description.strip().lower()
+
+
+class InMemoryCartStore:
+    # Carts are keyed by (session_id, product_key) and hold plain dicts with
+    # id, description, price and quantity. Discount state is kept per session.
+    # remove_by_description drops every line whose description matches, since
+    # products with different ids can share one; a per-session index from
+    # description to product keys keeps that O(1) like add and edit.
+    # SQLiteCartStore exposes the same methods.
+
+    def __init__(self):
+        self._carts = {}
+        self._descriptions = {}
+        self._discounts = {}
+        self._lock = threading.Lock()
+
+    def items(self, session_id):
+        with self._lock:
+            return [dict(item) for item in self._carts.get(session_id, {}).values()]
+
+    def add_item(self, session_id, item):
+        return self._put(session_id, item, increment=True)
+
+    def set_item(self, session_id, item):
+        return self._put(session_id, item, increment=False)
+
+    def _put(self, session_id, item, increment):
+        key = product_key(item)
+        with self._lock:
+            cart = self._carts.setdefault(session_id, {})
+            existing = cart.get(key)
+            if existing is None:
+                existing = cart[key] = {"id": str(item["id"]), "description": item["description"], "price": item["price"], "quantity": 0}
+                self._descriptions.setdefault(session_id, {}).setdefault(description_key(item["description"]), set()).add(key)
+            existing["price"] = item["price"]
+            existing["quantity"] = existing["quantity"] + item["quantity"] if increment else item["quantity"]
+            return dict(existing)
+
+    def remove_by_description(self, session_id, description):
+        with self._lock:
+            keys = self._descriptions.get(session_id, {}).pop(description_key(description), set())
+            cart = self._carts.get(session_id, {})
+            for key in keys:
+                cart.pop(key, None)
+            return bool(keys)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._carts.pop(session_id, None)
+            self._descriptions.pop(session_id, None)
+
+    def discount(self, session_id):
+        with self._lock:
+            return dict(self._discounts.get(session_id, DEFAULT_DISCOUNT))
+
+    def bargain(self, session_id):
+        with self._lock:
+            state = self._discounts.setdefault(session_id, dict(DEFAULT_DISCOUNT))
+            state["bargaining_attempts"] += 1
+            if state["current_discount"] < state["max_discount"]:
+                state["current_discount"] += BARGAIN_STEP
+            return dict(state)
+
+
+class SQLiteCartStore:
+    # Shared by every worker process through one WAL-mode database file. Each thread
+    # gets its own connection, and every mutation is a single atomic statement, so
+    # there is no cross-process lock beyond SQLite's own short write lock.
+
+    def __init__(self, path="cart.db", timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cart_items (
+                session_id TEXT NOT NULL,
+                product_key TEXT NOT NULL,
+                id TEXT NOT NULL,
+                description TEXT NOT NULL,
+                description_key TEXT NOT NULL,
+                price REAL NOT NULL,
+                quantity INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (session_id, product_key)
+            );
+            CREATE INDEX IF NOT EXISTS cart_items_description ON cart_items (session_id, description_key);
+            CREATE TABLE IF NOT EXISTS discounts (
+                session_id TEXT PRIMARY KEY,
+                current_discount REAL NOT NULL,
+                max_discount REAL NOT NULL,
+                bargaining_attempts INTEGER NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def items(self, session_id):
+        rows = self._conn().execute(
+            "SELECT id, description, price, quantity FROM cart_items WHERE session_id = ? ORDER BY rowid",
+            (session_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_item(self, session_id, item):
+        return self._put(session_id, item, "quantity + excluded.quantity")
+
+    def set_item(self, session_id, item):
+        return self._put(session_id, item, "excluded.quantity")
+
+    def _put(self, session_id, item, quantity_expr):
+        key = product_key(item)
+        conn = self._conn()
+        conn.execute(
+            f"""INSERT INTO cart_items (session_id, product_key, id, description, description_key, price, quantity, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, product_key) DO UPDATE SET
+                    quantity = {quantity_expr}, price = excluded.price, updated_at = excluded.updated_at""",
+            (session_id, key, str(item["id"]), item["description"], description_key(item["description"]),
+             item["price"], item["quantity"], time.time()),
+        )
+        row = conn.execute(
+            "SELECT id, description, price, quantity FROM cart_items WHERE session_id = ? AND product_key = ?",
+            (session_id, key),
+        ).fetchone()
+        return dict(row)
+
+    def remove_by_description(self, session_id, description):
+        cursor = self._conn().execute(
+            "DELETE FROM cart_items WHERE session_id = ? AND description_key = ?",
+            (session_id, description_key(description)),
+        )
+        return cursor.rowcount > 0
+
+    def clear(self, session_id):
+        self._conn().execute("DELETE FROM cart_items WHERE session_id = ?", (session_id,))
+
+    def discount(self, session_id):
+        row = self._conn().execute(
+            "SELECT current_discount, max_discount, bargaining_attempts FROM discounts WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        return dict(row) if row else dict(DEFAULT_DISCOUNT)
+
+    def bargain(self, session_id):
+        conn = self._conn()
+        conn.execute(
+            """INSERT INTO discounts (session_id, current_discount, max_discount, bargaining_attempts)
+               VALUES (?, ?, ?, 1)
+               ON CONFLICT (session_id) DO UPDATE SET
+                   bargaining_attempts = bargaining_attempts + 1,
+                   current_discount = CASE WHEN current_discount < max_discount
+                                           THEN current_discount + ? ELSE current_discount END""",
+            (session_id, DEFAULT_DISCOUNT["current_discount"] + BARGAIN_STEP, DEFAULT_DISCOUNT["max_discount"], BARGAIN_STEP),
+        )
+        return self.discount(session_id)
+
+
+def create_cart_store():
+    backend = os.getenv("CART_BACKEND", "memory")
+    if backend == "sqlite":
+        return SQLiteCartStore(os.getenv("CART_DB_PATH", "cart.db"))
+    if backend != "memory":
+        raise ValueError(f"Unknown CART_BACKEND: {backend}")
+    return InMemoryCartStore()
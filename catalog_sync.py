@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import time
+from embedding_cache import file_content_hash, point_id_for
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+DEFAULT_DESCRIPTION = "No description available."
+MANIFEST_VERSION = 1
+
+
+# Sidecar metadata: {"file_name.jpg": {"description": "...", "price": 100.0}, ...}
+def load_catalog(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "files": {}, "pending_deletes": []}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {path}: {manifest.get('version')}")
+    return manifest
+
+
+# Written to a temporary file and renamed, so an interrupted sync never leaves a torn manifest
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class CatalogSync:
+    # Keeps the collection in step with image_folder. The manifest maps each file to its size,
+    # mtime, content hash, point id and catalog metadata from the last successful sync:
+    #   - files whose size and mtime are unchanged are skipped without being read
+    #   - files that were touched but hash the same only have their manifest entry refreshed
+    #   - new or changed files go through create_vector_db, whose embedding cache means a
+    #     metadata-only change re-upserts the payload without re-embedding
+    #   - points no file maps to any more (deleted or replaced images) are deleted
+    #   - files with identical bytes share a point whose payload names one of them, the owner;
+    #     when the owner is removed or changed the point is re-upserted from a surviving copy
+    # so each run costs time proportional to what changed rather than to the catalog size.
+    # Images that are in neither the catalog nor the manifest (e.g. uploaded through /ingest/)
+    # are left alone, and metadata missing from the catalog falls back to what the manifest
+    # recorded, so a sync never overwrites a payload with placeholder defaults.
+
+    def __init__(self, ingestor, catalog_path=None, manifest_path="ingest_manifest.json"):
+        self.ingestor = ingestor
+        self.catalog_path = catalog_path
+        self.manifest_path = manifest_path
+
+    def scan(self):
+        files = {}
+        with os.scandir(self.ingestor.image_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    files[entry.name] = entry.stat()
+        return files
+
+    def sync(self):
+        start = time.perf_counter()
+        catalog = load_catalog(self.catalog_path)
+        manifest = load_manifest(self.manifest_path)
+        previous = manifest["files"]
+        files = self.scan()
+
+        # Entry for every tracked file, and the subset whose stored payload would still be accurate
+        candidates = {}
+        fresh = set()
+        untracked = 0
+        for file_name, stat in sorted(files.items()):
+            old = previous.get(file_name)
+            if old is None and file_name not in catalog:
+                untracked += 1
+                continue
+            metadata = self._metadata(catalog.get(file_name, {}), old or {})
+            if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime_ns and self._same_metadata(old, metadata):
+                candidates[file_name] = old
+                fresh.add(file_name)
+                continue
+
+            digest = file_content_hash(os.path.join(self.ingestor.image_folder, file_name))
+            candidates[file_name] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest,
+                                     "point_id": point_id_for(digest), **metadata}
+            if old and old["hash"] == digest and self._same_metadata(old, metadata):
+                fresh.add(file_name)
+
+        # Files with identical bytes share one point, whose payload can only describe one of them:
+        # the owner. A point is upserted only when its owner is gone or changed, and then from a
+        # surviving file, preferring the previous owner.
+        groups = {}
+        for file_name, entry in candidates.items():
+            groups.setdefault(entry["point_id"], []).append(file_name)
+        previous_sharers = {}
+        for entry in previous.values():
+            previous_sharers[entry["point_id"]] = previous_sharers.get(entry["point_id"], 0) + 1
+
+        current = {}
+        to_upsert = {}
+        for point_id, names in groups.items():
+            owner = next((name for name in names if name in fresh and self._owned(previous[name], previous_sharers)), None)
+            if owner is not None:
+                current.update(self._group_entries(candidates, names, owner))
+                continue
+            to_upsert[point_id] = next((name for name in names if name in previous
+                                        and previous[name]["point_id"] == point_id and previous[name].get("owner")), names[0])
+
+        summary = {"scanned": len(files), "unchanged": len(fresh), "untracked": untracked,
+                   "duplicates": sum(len(names) - 1 for names in groups.values()), "upserted": 0, "deleted": 0,
+                   "removed_files": len(set(previous) - set(files)), "failed": []}
+        if to_upsert:
+            result = self.ingestor.create_vector_db([{"file_name": owner, "description": candidates[owner]["description"],
+                                                      "price": candidates[owner]["price"]} for owner in to_upsert.values()])
+            failed = {failure["file_name"] for failure in result["failed"]}
+            for point_id, owner in to_upsert.items():
+                if owner not in failed:
+                    current.update(self._group_entries(candidates, groups[point_id], owner))
+                    summary["upserted"] += 1
+                    continue
+                # Keep the old entries, and with them the old points, so the files are retried next run
+                for name in groups[point_id]:
+                    if name in previous:
+                        current[name] = previous[name]
+            summary["failed"] = result["failed"]
+
+        live = {entry["point_id"] for entry in current.values()}
+        stale = {entry["point_id"] for entry in previous.values()} - live
+        pending = (set(manifest.get("pending_deletes", [])) | stale) - live
+        if pending:
+            try:
+                self.ingestor.delete_points(sorted(pending))
+                summary["deleted"] = len(pending)
+                pending = set()
+            except Exception as e:
+                logging.error(f"Error deleting {len(pending)} stale points, will retry on the next sync: {e}")
+
+        save_manifest(self.manifest_path, {"version": MANIFEST_VERSION, "files": current, "pending_deletes": sorted(pending)})
+        logging.info(f"Synced {self.ingestor.image_folder} in {time.perf_counter() - start:.2f}s: {summary['scanned']} files, "
+                     f"{summary['unchanged']} unchanged, {summary['untracked']} untracked, {summary['duplicates']} duplicates, "
+                     f"{summary['upserted']} points upserted, {summary['deleted']} points deleted, "
+                     f"{len(summary['failed'])} failed")
+        return summary
+
+    # Polls rather than relying on filesystem events so it also works on network and container mounts
+    def watch(self, interval=30.0):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logging.error(f"Catalog sync failed: {e}")
+            time.sleep(interval)
+
+    @staticmethod
+    def _metadata(metadata, previous):
+        return {"description": metadata.get("description", previous.get("description", DEFAULT_DESCRIPTION)),
+                "price": float(metadata.get("price", previous.get("price", 0.0)))}
+
+    @staticmethod
+    def _group_entries(candidates, names, owner):
+        return {name: {**candidates[name], "owner": name == owner} for name in names}
+
+    # Manifests written before owners were recorded only know the owner of unshared points
+    @staticmethod
+    def _owned(entry, previous_sharers):
+        return entry.get("owner", previous_sharers[entry["point_id"]] == 1)
+
+    @staticmethod
+    def _same_metadata(entry, metadata):
+        return entry.get("description") == metadata["description"] and entry.get("price") == metadata["price"]
@@ -0,0 +1,110 @@
+import logging
+import os
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+PAYLOAD_INDEXES = {
+    "price": models.PayloadSchemaType.FLOAT,
+    "file_name": models.PayloadSchemaType.KEYWORD,
+}
+
+
+class CollectionSchema:
+    # Declarative description of the image_vectors collection. ensure() creates the
+    # collection if it's missing and otherwise migrates it in place: Qdrant rebuilds
+    # storage and quantized copies from the vectors it already holds, so nothing is
+    # re-embedded.
+
+    def __init__(self, vector_size=512, distance=models.Distance.COSINE, on_disk=False, quantization=None,
+                 quantile=0.99, always_ram=True, oversampling=2.0, payload_indexes=None):
+        if quantization not in (None, "int8"):
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.vector_size = vector_size
+        self.distance = distance
+        self.on_disk = on_disk
+        self.quantization = quantization
+        self.quantile = quantile
+        self.always_ram = always_ram
+        self.oversampling = oversampling
+        self.payload_indexes = PAYLOAD_INDEXES if payload_indexes is None else payload_indexes
+
+    @classmethod
+    def from_env(cls, vector_size=512):
+        return cls(
+            vector_size=vector_size,
+            on_disk=os.getenv("QDRANT_ON_DISK", "0") == "1",
+            quantization=os.getenv("QDRANT_QUANTIZATION") or None,
+            oversampling=float(os.getenv("QDRANT_OVERSAMPLING", "2.0")),
+        )
+
+    def vectors_config(self):
+        return models.VectorParams(size=self.vector_size, distance=self.distance, on_disk=self.on_disk)
+
+    def quantization_config(self):
+        if self.quantization != "int8":
+            return None
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=self.quantile, always_ram=self.always_ram,
+        ))
+
+    # Quantized search over-fetches candidates and rescores them with the original vectors
+    def search_params(self):
+        if self.quantization is None:
+            return None
+        return models.SearchParams(quantization=models.QuantizationSearchParams(rescore=True, oversampling=self.oversampling))
+
+    def ensure(self, client, collection_name):
+        try:
+            info = client.get_collection(collection_name=collection_name)
+        except Exception:
+            logging.info(f"Collection {collection_name} does not exist, creating a new one.")
+            client.create_collection(
+                collection_name=collection_name,
+                vectors_config=self.vectors_config(),
+                quantization_config=self.quantization_config(),
+            )
+            logging.info(f"Created new collection: {collection_name}")
+            self._ensure_payload_indexes(client, collection_name, {})
+            return
+
+        logging.info(f"Collection {collection_name} already exists.")
+        self.migrate(client, collection_name, info)
+
+    def migrate(self, client, collection_name, info):
+        vectors = info.config.params.vectors
+        current_on_disk = bool(getattr(vectors, "on_disk", False))
+        if current_on_disk != self.on_disk:
+            logging.info(f"Migrating {collection_name}: on_disk {current_on_disk} -> {self.on_disk}")
+            client.update_collection(collection_name=collection_name,
+                                     vectors_config={"": models.VectorParamsDiff(on_disk=self.on_disk)})
+
+        current = info.config.quantization_config
+        wanted = self.quantization_config()
+        if wanted is None and current is not None:
+            logging.info(f"Migrating {collection_name}: disabling quantization")
+            client.update_collection(collection_name=collection_name, quantization_config=models.Disabled.DISABLED)
+        elif wanted is not None and current != wanted:
+            logging.info(f"Migrating {collection_name}: enabling {self.quantization} quantization")
+            client.update_collection(collection_name=collection_name, quantization_config=wanted)
+
+        self._ensure_payload_indexes(client, collection_name, info.payload_schema or {})
+
+    def _ensure_payload_indexes(self, client, collection_name, existing):
+        for field_name, field_schema in self.payload_indexes.items():
+            if field_name not in existing:
+                client.create_payload_index(collection_name=collection_name, field_name=field_name, field_schema=field_schema)
+                logging.info(f"Created {field_schema} payload index on {collection_name}.{field_name}")
+
+
+def price_filter(gte=None, lte=None):
+    if gte is None and lte is None:
+        return None
+    return models.Filter(must=[models.FieldCondition(key="price", range=models.Range(gte=gte, lte=lte))])
+
+
+if __name__ == "__main__":
+    # Apply the schema from the environment to an existing deployment:
+    #   QDRANT_QUANTIZATION=int8 QDRANT_ON_DISK=1 python collection_schema.py
+    logging.basicConfig(level=logging.INFO)
+    client = QdrantClient(url=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    CollectionSchema.from_env().ensure(client, os.getenv("QDRANT_COLLECTION", "image_vectors"))
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from fastapi import WebSocket
+import metrics
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, room: str):
+        self.websocket = websocket
+        self.room = room
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.writer = None
+        self.closed = False
+
+
+class ConnectionManager:
+    # Every socket gets a bounded outgoing queue drained by its own writer task, so
+    # send_message only enqueues and a slow client can never hold up the others.
+    # When a queue is full the overflow policy decides what happens:
+    #   drop_oldest - discard the oldest queued message
+    #   coalesce    - replace a queued message with the same coalesce_key, else drop the oldest
+    #   disconnect  - close the socket; the client is expected to reconnect and resync
+
+    def __init__(self, queue_size=100, overflow="drop_oldest", send_timeout=5.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.rooms = {}
+        self.connections = {}
+        # Close tasks started from _enqueue, held so they aren't garbage collected mid-close
+        self.closing = set()
+
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self.send_errors = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+
+    @property
+    def active_connections(self):
+        return list(self.connections)
+
+    async def connect(self, websocket: WebSocket, room: str = "default"):
+        await websocket.accept()
+        connection = Connection(websocket, room)
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.connections[websocket] = connection
+        self.rooms.setdefault(room, set()).add(connection)
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.closed = True
+        members = self.rooms.get(connection.room)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.rooms[connection.room]
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    # room=None broadcasts to every connection
+    async def send_message(self, message: str, room: str = None, coalesce_key: str = None):
+        if room is None:
+            targets = list(self.connections.values())
+        else:
+            targets = list(self.rooms.get(room, ()))
+        for connection in targets:
+            self._enqueue(connection, message, coalesce_key)
+
+    def _enqueue(self, connection, message, coalesce_key):
+        if connection.closed:
+            return
+        queue = connection.queue
+        if len(queue) >= self.queue_size:
+            if self.overflow == "disconnect":
+                logging.warning(f"WebSocket queue full in room {connection.room}, disconnecting slow client")
+                self.messages_dropped += len(queue)
+                self.disconnect(connection.websocket)
+                task = asyncio.create_task(self._close(connection.websocket))
+                self.closing.add(task)
+                task.add_done_callback(self.closing.discard)
+                return
+            if self.overflow == "coalesce" and coalesce_key is not None:
+                for i, (key, _) in enumerate(queue):
+                    if key == coalesce_key:
+                        del queue[i]
+                        queue.append((coalesce_key, message))
+                        self.messages_dropped += 1
+                        return
+            queue.popleft()
+            self.messages_dropped += 1
+        queue.append((coalesce_key, message))
+        connection.wakeup.set()
+
+    async def _writer(self, connection):
+        websocket = connection.websocket
+        try:
+            while True:
+                while not connection.queue:
+                    connection.wakeup.clear()
+                    await connection.wakeup.wait()
+                _, message = connection.queue.popleft()
+                start = time.perf_counter()
+                await asyncio.wait_for(websocket.send_text(message), self.send_timeout)
+                latency = time.perf_counter() - start
+                metrics.WS_SEND_LATENCY.observe(latency)
+                self.messages_sent += 1
+                self.send_latency_total += latency
+                self.send_latency_max = max(self.send_latency_max, latency)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Dropping WebSocket in room {connection.room} after send failure: {e}")
+            self.send_errors += 1
+            self.disconnect(websocket)
+            await self._close(websocket)
+
+    async def _close(self, websocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def stats(self):
+        depths = [len(connection.queue) for connection in self.connections.values()]
+        return {
+            "connections": len(self.connections),
+            "rooms": len(self.rooms),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "messages_sent": self.messages_sent,
+            "messages_dropped": self.messages_dropped,
+            "send_errors": self.send_errors,
+            "send_latency_avg": self.send_latency_total / self.messages_sent if self.messages_sent else 0.0,
+            "send_latency_max": self.send_latency_max,
+        }
@@ -0,0 +1,138 @@
+import os
+import fcntl
+import hashlib
+import logging
+import threading
+import uuid
+import numpy as np
+
+# Fixed namespace so the same image bytes always map to the same Qdrant point id
+POINT_ID_NAMESPACE = uuid.UUID("6f1d8f3e-2c4a-4b7e-9a51-3d0c5e8b7a21")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def point_id_for(digest):
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, digest))
+
+
+class EmbeddingCache:
+    # Append-only store: <model>.<dtype>.vectors holds one row per embedding and
+    # <model>.index holds one content hash per line, so line N describes row N.
+    # Vectors are always written before their index line, which lets readers in
+    # other processes memory-map the matrix without taking the lock. A writer that
+    # died between the two appends leaves orphan rows (or a torn index line), so
+    # both files are cut back to the last complete entry before every append.
+
+    def __init__(self, cache_dir, model_name, dim=512, dtype="float16"):
+        os.makedirs(cache_dir, exist_ok=True)
+        slug = model_name.replace("/", "--")
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.vectors")
+        self.index_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.index")
+        self.lock_path = os.path.join(cache_dir, f"{slug}.{self.dtype.name}.lock")
+
+        self._rows = {}
+        self._count = 0
+        self._index_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def __contains__(self, digest):
+        with self._lock:
+            self._refresh()
+            return digest in self._rows
+
+    def get(self, digest):
+        return self.get_many([digest]).get(digest)
+
+    def get_many(self, digests):
+        with self._lock:
+            self._refresh()
+            found = {}
+            for digest in digests:
+                row = self._rows.get(digest)
+                if row is not None:
+                    found[digest] = np.asarray(self._vectors[row], dtype=np.float32)
+            return found
+
+    def put(self, digest, vector):
+        self.put_many([digest], np.asarray(vector).reshape(1, -1))
+
+    def put_many(self, digests, vectors):
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have appended since we last looked
+                self._refresh()
+                new_rows = []
+                new_digests = []
+                for digest, vector in zip(digests, vectors):
+                    if digest not in self._rows and digest not in new_digests:
+                        new_digests.append(digest)
+                        new_rows.append(vector)
+                if not new_digests:
+                    return
+
+                self._truncate_torn_writes()
+                with open(self.vectors_path, "ab") as f:
+                    f.write(np.stack(new_rows).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.index_path, "ab") as f:
+                    f.write("".join(f"{digest}\n" for digest in new_digests).encode())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                self._refresh()
+                logging.info(f"Cached {len(new_digests)} embeddings ({self._count} total)")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Only called under the flock, so anything past the last complete entry belongs to a dead writer
+    def _truncate_torn_writes(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        for path, size in ((self.vectors_path, self._count * row_bytes), (self.index_path, self._index_offset)):
+            try:
+                actual = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            if actual > size:
+                logging.warning(f"Discarding {actual - size} bytes of an interrupted write from {path}")
+                os.truncate(path, size)
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return
+        if size == self._index_offset:
+            return
+
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read(size - self._index_offset)
+        # Only consume complete lines; a partially written one is picked up next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            self._rows.setdefault(line.decode(), self._count)
+            self._count += 1
+        self._index_offset += end
+
+        if self._count:
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self._count, self.dim))
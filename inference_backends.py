@@ -0,0 +1,142 @@
+import copy
+import fcntl
+import logging
+import os
+import numpy as np
+import torch
+
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+def configure_threads(num_threads=None, interop_threads=None):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Can only be set before the first parallel op runs
+            logging.warning(f"Could not set torch interop threads: {e}")
+
+
+class TorchBackend:
+    # Eager PyTorch under inference mode; the reference every other backend is compared against
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model.eval()
+
+    def image_features(self, pixel_values):
+        with torch.inference_mode():
+            return self.model.get_image_features(pixel_values=torch.as_tensor(pixel_values)).numpy()
+
+    def text_features(self, input_ids, attention_mask):
+        with torch.inference_mode():
+            return self.model.get_text_features(
+                input_ids=torch.as_tensor(input_ids), attention_mask=torch.as_tensor(attention_mask)
+            ).numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    # Dynamic int8 quantization of every Linear layer, which is where CLIP spends most of its FLOPs
+    name = "torch-int8"
+
+    def __init__(self, model):
+        quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).eval(), {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(quantized)
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+class OnnxBackend:
+    # Exports both towers to ONNX once (cached under export_dir) and runs them with ONNX Runtime.
+    # Workers that start together serialise the export on a flock, and each graph is written to a
+    # temporary file and renamed into place, so nobody loads a half-written or crash-truncated graph.
+    name = "onnx"
+    OPSET = 17
+
+    def __init__(self, model, model_name, export_dir="./onnx_models", num_threads=None):
+        import onnxruntime as ort
+
+        slug = model_name.replace("/", "--")
+        image_path = os.path.join(export_dir, f"{slug}.image.onnx")
+        text_path = os.path.join(export_dir, f"{slug}.text.onnx")
+        if not (os.path.exists(image_path) and os.path.exists(text_path)):
+            os.makedirs(export_dir, exist_ok=True)
+            with open(os.path.join(export_dir, f"{slug}.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # Another worker may have finished the export while we waited for the lock
+                    if not (os.path.exists(image_path) and os.path.exists(text_path)):
+                        self._export(model.eval(), image_path, text_path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(image_path, options, providers=providers)
+        self.text_session = ort.InferenceSession(text_path, options, providers=providers)
+
+    def image_features(self, pixel_values):
+        pixel_values = np.asarray(pixel_values, dtype=np.float32)
+        return self.image_session.run(None, {"pixel_values": pixel_values})[0]
+
+    def text_features(self, input_ids, attention_mask):
+        return self.text_session.run(None, {
+            "input_ids": np.asarray(input_ids, dtype=np.int64),
+            "attention_mask": np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+
+    def _export(self, model, image_path, text_path):
+        logging.info(f"Exporting CLIP towers to {image_path} and {text_path}")
+        image_tmp = f"{image_path}.tmp"
+        text_tmp = f"{text_path}.tmp"
+        with torch.inference_mode():
+            torch.onnx.export(
+                _ImageTower(model), (torch.zeros(1, 3, 224, 224),), image_tmp,
+                input_names=["pixel_values"], output_names=["image_embeds"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                opset_version=self.OPSET,
+            )
+            ids = torch.ones(1, 8, dtype=torch.int64)
+            torch.onnx.export(
+                _TextTower(model), (ids, torch.ones_like(ids)), text_tmp,
+                input_names=["input_ids", "attention_mask"], output_names=["text_embeds"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "text_embeds": {0: "batch"},
+                },
+                opset_version=self.OPSET,
+            )
+        os.replace(image_tmp, image_path)
+        os.replace(text_tmp, text_path)
+
+
+def create_backend(name, model, model_name, num_threads=None):
+    if name == "torch":
+        return TorchBackend(model)
+    if name == "torch-int8":
+        return QuantizedTorchBackend(model)
+    if name == "onnx":
+        return OnnxBackend(model, model_name, export_dir=os.getenv("ONNX_EXPORT_DIR", "./onnx_models"), num_threads=num_threads)
+    raise ValueError(f"Unknown CLIP_BACKEND: {name}; expected one of {', '.join(BACKENDS)}")
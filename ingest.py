@@ -1,145 +1,457 @@
+import argparse
 import os
 import logging
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams
-import uuid
+from qdrant_client.http.models import PointIdsList
+from catalog_sync import CatalogSync
+from collection_schema import CollectionSchema
+from embedding_cache import EmbeddingCache, file_content_hash, point_id_for
+import metrics
+from model_registry import CLIP_BACKEND, CLIP_MODEL_NAME, get_backend, get_clip
+from preprocess import PreprocessPipeline
 
 logging.basicConfig(level=logging.INFO)
 
+class BulkUpserter:
+    # Buffers points into fixed-size chunks and uploads them from a thread pool with
+    # wait=False, so embedding of the next batch overlaps with the network writes.
+    # The final chunk is sent with wait=True once every other chunk is acknowledged,
+    # which acts as the consistency barrier for the whole upload.
+
+    def __init__(self, client, collection_name, chunk_size=256, parallelism=4, retries=3, backoff=0.5, on_success=None):
+        self.client = client
+        self.collection_name = collection_name
+        self.chunk_size = chunk_size
+        self.parallelism = parallelism
+        self.retries = retries
+        self.backoff = backoff
+        self.on_success = on_success
+        self.inserted = 0
+        self.failed = []
+
+        self._ids = []
+        self._vectors = []
+        self._payloads = []
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="upsert")
+        self._start = time.perf_counter()
+
+    def add(self, ids, vectors, payloads):
+        self._ids.extend(ids)
+        self._vectors.extend(vectors)
+        self._payloads.extend(payloads)
+        # Strictly greater so there is always a tail chunk left for the barrier in flush()
+        while len(self._ids) > self.chunk_size:
+            self._submit(*self._take(self.chunk_size))
+
+    def flush(self):
+        try:
+            while self._pending:
+                self._collect(self._pending.popleft())
+            if self._ids:
+                ids, vectors, payloads = self._take(len(self._ids))
+                try:
+                    self._upload(ids, vectors, payloads, wait=True)
+                    self._record_success(ids, vectors, payloads)
+                except Exception as e:
+                    self._record_failure(payloads, e)
+        finally:
+            self._executor.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - self._start
+        logging.info(f"Upserted {self.inserted} points into {self.collection_name} in {elapsed:.2f}s ({len(self.failed)} failed)")
+
+    def _take(self, count):
+        ids, self._ids = self._ids[:count], self._ids[count:]
+        vectors, self._vectors = self._vectors[:count], self._vectors[count:]
+        payloads, self._payloads = self._payloads[:count], self._payloads[count:]
+        return ids, np.asarray(vectors, dtype=np.float32), payloads
+
+    def _submit(self, ids, vectors, payloads):
+        # Bound the number of chunks in flight so memory stays flat on large catalogs
+        while len(self._pending) >= self.parallelism * 2:
+            self._collect(self._pending.popleft())
+        future = self._executor.submit(self._upload, ids, vectors, payloads, False)
+        self._pending.append((future, ids, vectors, payloads))
+
+    def _collect(self, entry):
+        future, ids, vectors, payloads = entry
+        try:
+            future.result()
+        except Exception as e:
+            self._record_failure(payloads, e)
+            return
+        self._record_success(ids, vectors, payloads)
+
+    def _record_success(self, ids, vectors, payloads):
+        self.inserted += len(ids)
+        if self.on_success:
+            try:
+                self.on_success(ids, vectors, payloads)
+            except Exception as e:
+                logging.error(f"Error in upsert listener: {e}")
+
+    def _record_failure(self, payloads, error):
+        logging.error(f"Error upserting chunk of {len(payloads)} points: {error}")
+        self.failed.extend({"file_name": payload["file_name"], "error": "upsert failed"} for payload in payloads)
+
+    def _upload(self, ids, vectors, payloads, wait):
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.span("ingest_upsert"):
+                    self.client.upload_collection(
+                        collection_name=self.collection_name,
+                        vectors=vectors,
+                        payload=payloads,
+                        ids=ids,
+                        batch_size=len(ids),
+                        parallel=1,
+                        max_retries=1,
+                        wait=wait,
+                    )
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"Upsert of {len(ids)} points failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
 class VectorIngestor:
     VECTOR_SIZE = 512
+    BATCH_SIZE = 32
+    MODEL_NAME = CLIP_MODEL_NAME
+    CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+    UPSERT_CHUNK_SIZE = int(os.getenv("UPSERT_CHUNK_SIZE", "256"))
+    UPSERT_PARALLELISM = int(os.getenv("UPSERT_PARALLELISM", "4"))
+    UPSERT_RETRIES = 3
+    PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+    # >0 decodes and preprocesses images in that many worker processes, overlapped with inference
+    DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "0"))
 
-    def __init__(self, image_folder, url="http://localhost:6333"):
+    def __init__(self, image_folder, url="http://localhost:6333", batch_size=BATCH_SIZE, cache_dir=CACHE_DIR,
+                 client=None, prefer_grpc=PREFER_GRPC, upsert_chunk_size=UPSERT_CHUNK_SIZE,
+                 upsert_parallelism=UPSERT_PARALLELISM, upsert_retries=UPSERT_RETRIES, decode_workers=DECODE_WORKERS,
+                 schema=None):
         self.image_folder = image_folder
         self.url = url
-        self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        self.client = QdrantClient(url=self.url, prefer_grpc=False)
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        # Vectors differ by backend (int8 and ONNX aren't bit-identical to torch) and by preprocessing
+        # (PreprocessPipeline's draft-mode decode doesn't reproduce CLIPProcessor's pixels exactly),
+        # so each combination gets its own cache files
+        preprocessing = "pipeline" if decode_workers > 0 else "processor"
+        cache_key = f"{self.MODEL_NAME}.{CLIP_BACKEND}.{preprocessing}"
+        self.cache = EmbeddingCache(cache_dir, cache_key, self.VECTOR_SIZE) if cache_dir else None
+        # One worker pool for the ingestor's lifetime, started by the first pipelined ingest
+        self.preprocess = PreprocessPipeline(workers=decode_workers, batch_size=batch_size) if decode_workers > 0 else None
+        # Pass client=QdrantClient(":memory:") to run against a local in-memory instance
+        self.client = client or QdrantClient(url=self.url, prefer_grpc=prefer_grpc)
         self.collection_name = "image_vectors"
+        # Vector storage, quantization and payload indexes. In-RAM float32 vectors by default;
+        # int8 quantization (QDRANT_QUANTIZATION=int8) and on-disk vectors (QDRANT_ON_DISK=1) are opt-in
+        self.schema = schema or CollectionSchema.from_env(self.VECTOR_SIZE)
+        self.upsert_chunk_size = upsert_chunk_size
+        self.upsert_parallelism = upsert_parallelism
+        self.upsert_retries = upsert_retries
+        self.upsert_listeners = []
+        self.delete_listeners = []
+
+    # CLIP comes from the shared per-process registry and is only loaded on first use
+    @property
+    def model(self):
+        return get_clip(self.MODEL_NAME)[0]
+
+    @property
+    def processor(self):
+        return get_clip(self.MODEL_NAME)[1]
+
+    # Image/text towers run on the configured CLIP_BACKEND (torch, torch-int8 or onnx)
+    @property
+    def backend(self):
+        return get_backend(self.MODEL_NAME)
+
+    def shutdown(self):
+        if self.preprocess is not None:
+            self.preprocess.shutdown()
+
+    # Listeners are called with (ids, vectors, payloads) after each chunk is written to Qdrant
+    def add_upsert_listener(self, listener):
+        self.upsert_listeners.append(listener)
+
+    def _notify_upsert(self, ids, vectors, payloads):
+        for listener in self.upsert_listeners:
+            listener(ids, vectors, payloads)
+
+    # Listeners are called with the ids of points after they are deleted from Qdrant
+    def add_delete_listener(self, listener):
+        self.delete_listeners.append(listener)
+
+    def delete_points(self, point_ids):
+        point_ids = list(point_ids)
+        if not point_ids:
+            return
+        with metrics.span("ingest_delete"):
+            self.client.delete(collection_name=self.collection_name, points_selector=PointIdsList(points=point_ids), wait=True)
+        logging.info(f"Deleted {len(point_ids)} points from {self.collection_name}")
+        for listener in self.delete_listeners:
+            try:
+                listener(point_ids)
+            except Exception as e:
+                logging.error(f"Error in delete listener: {e}")
+
+    def extract_text_features(self, text):
+        inputs = self.processor(text=[text], return_tensors="np", padding=True, truncation=True)
+        return self.backend.text_features(inputs['input_ids'], inputs['attention_mask']).flatten()
 
     def extract_features(self, image_path):
         try:
             image = Image.open(image_path).convert("RGB")
-            inputs = self.processor(images=image, return_tensors="pt")
-            outputs = self.model.get_image_features(pixel_values=inputs['pixel_values'])
-            features = outputs.detach().numpy().flatten()  # Flatten the features
+            inputs = self.processor(images=image, return_tensors="np")
+            features = self.backend.image_features(inputs['pixel_values']).flatten()  # Flatten the features
             logging.info(f"Extracted features for {image_path} with shape: {features.shape}")
             return features
         except Exception as e:
             logging.error(f"Error extracting features from {image_path}: {e}")
             return None
 
-    def create_vector_db(self, images):
-        self._create_new_collection_if_not_exists()
+    # Returns the paths that were embedded and an (N, VECTOR_SIZE) float32 array of their features.
+    # Files that could not be embedded are appended to `failures` as (path, error) pairs.
+    def extract_features_batch(self, image_paths, failures=None, on_batch=None):
+        valid_paths = []
+        batches = []
+        for paths, features in self.iter_feature_batches(image_paths, failures, on_batch):
+            valid_paths.extend(paths)
+            batches.append(features)
+
+        if not batches:
+            return valid_paths, np.empty((0, self.VECTOR_SIZE), dtype=np.float32)
+        return valid_paths, np.concatenate(batches)
 
-        points = []
-        for image in images:
-            points.extend(self._process_image(image))
+    # Yields (paths, features) per batch so callers can start on a batch while the next one is embedded
+    def iter_feature_batches(self, image_paths, failures=None, on_batch=None):
+        embedded = 0
+        start = time.perf_counter()
+        if self.decode_workers > 0:
+            batches = self._iter_pipelined_batches(image_paths, failures)
+        else:
+            batches = self._iter_serial_batches(image_paths, failures)
+        for count, paths, features in batches:
+            if on_batch:
+                on_batch(count)
+            if paths:
+                embedded += len(paths)
+                yield paths, features.astype(np.float32, copy=False)
 
-        self._upsert_points(points)
+        elapsed = time.perf_counter() - start
+        rate = embedded / elapsed if elapsed > 0 else 0.0
+        if embedded:
+            metrics.INGEST_RATE.set(rate)
+        logging.info(f"Extracted features for {embedded}/{len(image_paths)} images in {elapsed:.2f}s ({rate:.1f} images/sec)")
 
-    def _create_new_collection_if_not_exists(self):
+    def _iter_serial_batches(self, image_paths, failures):
+        for i in range(0, len(image_paths), self.batch_size):
+            batch_paths = image_paths[i:i + self.batch_size]
+            paths, features = self._extract_batch(batch_paths, failures)
+            yield len(batch_paths), paths, features
+
+    def _iter_pipelined_batches(self, image_paths, failures):
+        for paths, pixel_values, batch_failures in self.preprocess.iter_batches(image_paths):
+            if failures is not None:
+                failures.extend(batch_failures)
+            count = len(paths) + len(batch_failures)
+            if not paths:
+                yield count, [], None
+                continue
+            paths, features = self._embed_pixels(paths, pixel_values, failures)
+            yield count, paths, features
+
+    def _embed_pixels(self, paths, pixel_values, failures=None):
         try:
-            collection_info = self.client.get_collection(collection_name=self.collection_name)
-            if collection_info:
-                logging.info(f"Collection {self.collection_name} already exists.")
-                return
+            with metrics.span("ingest_embed"):
+                return paths, self.backend.image_features(pixel_values)
         except Exception as e:
-            logging.info(f"Collection {self.collection_name} does not exist, creating a new one.")
+            logging.warning(f"Batch extraction failed ({e}), retrying {len(paths)} images individually")
+            good_paths = []
+            rows = []
+            for path, pixels in zip(paths, pixel_values):
+                try:
+                    rows.append(self.backend.image_features(pixels[None])[0])
+                    good_paths.append(path)
+                except Exception as row_error:
+                    logging.error(f"Error extracting features from {path}: {row_error}")
+                    if failures is not None:
+                        failures.append((path, str(row_error)))
+            return good_paths, np.stack(rows) if rows else None
+
+    def _extract_batch(self, image_paths, failures=None):
+        paths = []
+        images = []
+        for image_path in image_paths:
+            try:
+                images.append(Image.open(image_path).convert("RGB"))
+                paths.append(image_path)
+            except Exception as e:
+                logging.error(f"Error extracting features from {image_path}: {e}")
+                if failures is not None:
+                    failures.append((image_path, str(e)))
+
+        if not images:
+            return [], None
 
         try:
-            vector_params = VectorParams(size=self.VECTOR_SIZE, distance="Cosine")
-            self.client.create_collection(collection_name=self.collection_name, vectors_config=vector_params)
-            logging.info(f"Created new collection: {self.collection_name}")
+            with metrics.span("ingest_embed"):
+                inputs = self.processor(images=images, return_tensors="np")
+                return paths, self.backend.image_features(inputs['pixel_values'])
         except Exception as e:
-            logging.error(f"Error creating collection: {e}")
+            # Fall back to one image at a time so a single bad file doesn't sink the whole batch
+            logging.warning(f"Batch extraction failed ({e}), retrying {len(paths)} images individually")
+            good_paths = []
+            rows = []
+            for image_path in paths:
+                features = self.extract_features(image_path)
+                if features is not None:
+                    good_paths.append(image_path)
+                    rows.append(features)
+                elif failures is not None:
+                    failures.append((image_path, "feature extraction failed"))
+            if not rows:
+                return [], None
+            return good_paths, np.stack(rows)
 
-    def _process_image(self, image):
-        points = []
-        image_name = image['file_name']
-        image_path = os.path.join(self.image_folder, image_name)
-        if os.path.isfile(image_path):
-            features = self.extract_features(image_path)
-            if features is not None and features.shape[0] == self.VECTOR_SIZE:
-                points.append({
-                    "id": str(uuid.uuid4()),
-                    "vector": features.tolist(),
-                    "payload": {
-                        "file_name": image_name,
-                        "description": image['description'],
-                        "price": image['price']
-                    }
-                })
-                logging.info(f"Added {image_name} to points.")
-            else:
-                logging.warning(f"Skipping {image_name}: expected {self.VECTOR_SIZE} dimensions but got {features.shape[0] if features is not None else 'None'}")
-        else:
-            logging.warning(f"File {image_path} does not exist or is not a file.")
-        return points
+    # progress(done, total) is called as images are resolved from the cache or embedded
+    def create_vector_db(self, images, progress=None):
+        self._create_new_collection_if_not_exists()
+
+        summary = {"total": len(images), "cached": 0, "embedded": 0, "inserted": 0, "failed": []}
+        done = 0
+
+        def report(count):
+            nonlocal done
+            done += count
+            if progress:
+                progress(done, len(images))
+
+        entries = []
+        with metrics.span("ingest_hash"):
+            for image in images:
+                image_path = os.path.join(self.image_folder, image['file_name'])
+                if os.path.isfile(image_path):
+                    entries.append((image, image_path, file_content_hash(image_path)))
+                else:
+                    logging.warning(f"File {image_path} does not exist or is not a file.")
+                    summary["failed"].append({"file_name": image['file_name'], "error": "file not found"})
+                    report(1)
+
+        # Identical bytes map to the same point id, so only the last image per digest is kept
+        images_by_digest = {}
+        paths_by_digest = {}
+        for image, image_path, digest in entries:
+            images_by_digest[digest] = image
+            paths_by_digest.setdefault(digest, image_path)
 
-    def _upsert_points(self, points):
+        cached = self.cache.get_many(list(images_by_digest)) if self.cache else {}
+        to_embed = {path: digest for digest, path in paths_by_digest.items() if digest not in cached}
+        summary["cached"] = len(entries) - len(to_embed)
+        report(summary["cached"])
+        logging.info(f"Embedding cache: {summary['cached']} hits, {len(to_embed)} misses")
+
+        upserter = BulkUpserter(self.client, self.collection_name, chunk_size=self.upsert_chunk_size,
+                                parallelism=self.upsert_parallelism, retries=self.upsert_retries,
+                                on_success=self._notify_upsert)
         try:
-            if points:
-                self.client.upsert(collection_name=self.collection_name, points=points)
-                logging.info(f"Inserted {len(points)} points into the vector database.")
-            else:
-                logging.info("No valid points to upsert.")
+            self._add_points(upserter, images_by_digest, cached)
+
+            failures = []
+            for paths, features in self.iter_feature_batches(list(to_embed), failures=failures, on_batch=report):
+                digests = [to_embed[path] for path in paths]
+                if self.cache:
+                    self.cache.put_many(digests, features)
+                self._add_points(upserter, images_by_digest, dict(zip(digests, features)))
+                summary["embedded"] += len(paths)
+            summary["failed"].extend({"file_name": os.path.basename(path), "error": error} for path, error in failures)
+        finally:
+            upserter.flush()
+
+        summary["inserted"] = upserter.inserted
+        summary["failed"].extend(upserter.failed)
+        metrics.INGEST_IMAGES.inc(summary["cached"], result="cached")
+        metrics.INGEST_IMAGES.inc(summary["embedded"], result="embedded")
+        metrics.INGEST_IMAGES.inc(len(summary["failed"]), result="failed")
+        return summary
+
+    def _add_points(self, upserter, images_by_digest, vectors):
+        ids = []
+        rows = []
+        payloads = []
+        for digest, features in vectors.items():
+            image = images_by_digest[digest]
+            if features.shape[0] != self.VECTOR_SIZE:
+                logging.warning(f"Skipping {image['file_name']}: expected {self.VECTOR_SIZE} dimensions but got {features.shape[0]}")
+                continue
+            point_id = point_id_for(digest)
+            ids.append(point_id)
+            rows.append(features)
+            payloads.append(self._payload(image, point_id))
+        if ids:
+            upserter.add(ids, rows, payloads)
+
+    # Searches Qdrant directly, e.g. with a payload filter; quantized collections are rescored
+    # against the original vectors
+    def search(self, query_vector, limit=5, query_filter=None):
+        return self.client.search(
+            collection_name=self.collection_name,
+            query_vector=np.asarray(query_vector, dtype=np.float32).tolist(),
+            query_filter=query_filter,
+            search_params=self.schema.search_params(),
+            limit=limit,
+            with_payload=True,
+        )
+
+    # Creates the collection, or brings an existing one up to the schema in place
+    def _create_new_collection_if_not_exists(self):
+        try:
+            self.schema.ensure(self.client, self.collection_name)
         except Exception as e:
-            logging.error(f"Error upserting points: {e}")
+            logging.error(f"Error creating collection: {e}")
 
-if __name__ == "__main__":
-    image_folder = "./images"
-    image_metadata = {
-        "th.jpg": {
-            "id": 1,
-            "description": "A high-quality pink summer t-shirt, designed with a long cut and crafted from premium fabric for maximum comfort and durability. Price is $100",
-            "price": 100.0
-        },
-        "thi.jpg": {
-            "id": 2,
-            "description": "A vibrant black summer t-shirt, featuring a long design and made from breathable fabric, ideal for casual outings and hot weather. Price is $100",
-            "price": 100.0
-        },
-        "pant1.jpg": {
-            "id": 3,
-            "description": "A well-crafted pair of quality pants, offering a perfect fit and made from durable fabric for everyday wear and comfort. Price is $120",
-            "price": 120.0
-        },
-        "pant.jpg": {
-            "id": 4,
-            "description": "Comfortable summer pants, made from elastic fabric, providing a relaxed fit and easy movement for warm weather activities. Price is $121",
-            "price": 121.0
-        },
-        "womentshirt.jpg": {
-            "id": 5,
-            "description": "A stylish women t-shirt with a long cut, made from soft fabric and designed for both comfort and elegance, suitable for various occasions. Price is $140",
-            "price": 140.0
-        },
-        "womentshirt1.jpg": {
-            "id": 6,
-            "description": "A blue summer t-shirt for women, featuring a long design and crafted from high-quality fabric, perfect for staying cool and fashionable. Price is $150",
-            "price": 150.0
-        },
-        "trouser.jpg": {
-            "id": 7,
-            "description": "A comfortable black summer trouser, designed with a long cut and made from soft fabric, ideal for casual wear and everyday use. Price is $78",
-            "price": 78.0
-        },
-        "trouser1.jpg": {
-            "id": 8,
-            "description": "A versatile blue summer trouser with a long fit, made from high-quality fabric for a stylish and comfortable look. Price is $72",
-            "price": 72.0
+    def _payload(self, image, point_id):
+        return {
+            "id": point_id,
+            "file_name": image['file_name'],
+            "description": image['description'],
+            "price": image['price']
         }
-    }
 
-    images = [{
-        "file_name": file_name,
-        "id": metadata["id"],
-        "description": metadata["description"],
-        "price": metadata["price"]
-    } for file_name, metadata in image_metadata.items()]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest catalog images into Qdrant")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sync = commands.add_parser("sync", help="embed new or changed images and delete the points of removed ones")
+    sync.add_argument("--images", default="./images", help="folder of catalog images")
+    sync.add_argument("--catalog", default="catalog.json", help="sidecar JSON of file name -> description and price")
+    sync.add_argument("--manifest", default="ingest_manifest.json", help="state from the previous sync")
+    sync.add_argument("--url", default="http://localhost:6333")
+    sync.add_argument("--watch", action="store_true", help="keep syncing every --interval seconds")
+    sync.add_argument("--interval", type=float, default=30.0)
+    args = parser.parse_args(argv)
 
-    ingestor = VectorIngestor(image_folder)
-    ingestor.create_vector_db(images)
+    ingestor = VectorIngestor(args.images, url=args.url)
+    catalog_sync = CatalogSync(ingestor, args.catalog, args.manifest)
+    try:
+        if args.watch:
+            catalog_sync.watch(args.interval)
+        else:
+            summary = catalog_sync.sync()
+            return 1 if summary["failed"] else 0
+    finally:
+        ingestor.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
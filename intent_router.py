@@ -0,0 +1,139 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+
+class Intent:
+    def __init__(self, name, phrases=(), exemplars=(), needs_search=True, needs_llm=True, needs_payment=False):
+        self.name = name
+        self.pattern = re.compile("|".join(re.escape(phrase) for phrase in phrases), re.IGNORECASE) if phrases else None
+        self.exemplars = list(exemplars)
+        self.needs_search = needs_search
+        self.needs_llm = needs_llm
+        self.needs_payment = needs_payment
+
+    def matches(self, text):
+        return self.pattern is not None and self.pattern.search(text) is not None
+
+
+# Checked in order, first match wins, mirroring the original if/elif chain in /query/
+INTENTS = [
+    Intent("add_to_cart", ["add to cart"],
+           exemplars=["add this to my cart", "put this in my basket", "I want to buy this"]),
+    Intent("delete_from_cart", ["delete from cart"],
+           exemplars=["remove this from my cart", "take this out of my basket", "I don't want this anymore"]),
+    Intent("update_cart", ["update cart"],
+           exemplars=["change the quantity in my cart", "update my basket"]),
+    Intent("checkout", ["proceed to check out"], needs_search=False, needs_payment=True,
+           exemplars=["I want to pay now", "take me to checkout", "complete my order"]),
+    Intent("discount", ["provide me discount"], needs_search=False,
+           exemplars=["can I get a discount", "give me a better price", "make it cheaper"]),
+]
+
+SEARCH_INTENT = Intent("search")
+
+_AMOUNT = r"(?:rs\.?|\$)?\s*(\d+(?:\.\d+)?)"
+PRICE_BETWEEN = re.compile(rf"\bbetween\s+{_AMOUNT}\s+(?:and|to|-)\s+{_AMOUNT}", re.IGNORECASE)
+PRICE_MAX = re.compile(rf"\b(?:under|below|less than|cheaper than|at most|up to|max(?:imum)?)\s+{_AMOUNT}", re.IGNORECASE)
+PRICE_MIN = re.compile(rf"\b(?:over|above|more than|at least|min(?:imum)?)\s+{_AMOUNT}", re.IGNORECASE)
+
+
+# Pulls a price constraint like "under $100", "over 50" or "between 20 and 80" out of the query.
+# Returns (gte, lte) with None for an open end, or None when the query has no price constraint.
+def parse_price_range(text):
+    match = PRICE_BETWEEN.search(text)
+    if match:
+        low, high = sorted((float(match.group(1)), float(match.group(2))))
+        return low, high
+    low = PRICE_MIN.search(text)
+    high = PRICE_MAX.search(text)
+    if low is None and high is None:
+        return None
+    return (float(low.group(1)) if low else None), (float(high.group(1)) if high else None)
+
+
+class IntentStats:
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, intent, stage, seconds):
+        with self._lock:
+            entry = self._stages.setdefault(intent, {}).setdefault(stage, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                intent: {
+                    stage: {"count": e["count"], "avg": e["total"] / e["count"], "max": e["max"]}
+                    for stage, e in stages.items()
+                }
+                for intent, stages in self._stages.items()
+            }
+
+
+class IntentRouter:
+    # Resolves an intent before any retrieval happens. Phrase patterns are tried first;
+    # if none match and an `embed` function is given, the query embedding is compared
+    # against cached embeddings of each intent's exemplar sentences.
+
+    def __init__(self, intents=INTENTS, default=SEARCH_INTENT, embed=None, threshold=0.9):
+        self.intents = intents
+        self.default = default
+        self.embed = embed
+        self.threshold = threshold
+        self.stats = IntentStats()
+        self._exemplar_matrix = None
+        self._exemplar_intents = None
+        self._lock = threading.Lock()
+
+    @property
+    def uses_classifier(self):
+        return self.embed is not None
+
+    def route(self, text):
+        for intent in self.intents:
+            if intent.matches(text):
+                return intent
+        if self.embed is not None:
+            return self._classify(text)
+        return self.default
+
+    @contextmanager
+    def timed(self, intent, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats.record(intent.name, stage, time.perf_counter() - start)
+
+    def _classify(self, text):
+        matrix, intents = self._exemplars()
+        if not intents:
+            return self.default
+        query = np.asarray(self.embed(text), dtype=np.float32)
+        # Not in place: embed may return the query cache's own array
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        return intents[best] if scores[best] >= self.threshold else self.default
+
+    def _exemplars(self):
+        with self._lock:
+            if self._exemplar_matrix is None:
+                rows = []
+                intents = []
+                for intent in self.intents:
+                    for exemplar in intent.exemplars:
+                        rows.append(np.asarray(self.embed(exemplar), dtype=np.float32))
+                        intents.append(intent)
+                matrix = np.stack(rows) if rows else np.empty((0, 0), dtype=np.float32)
+                if rows:
+                    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._exemplar_matrix, self._exemplar_intents = matrix, intents
+            return self._exemplar_matrix, self._exemplar_intents
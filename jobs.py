@@ -0,0 +1,103 @@
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IngestJob:
+    def __init__(self, images):
+        self.id = str(uuid.uuid4())
+        self.images = images
+        self.status = "queued"
+        self.total = len(images)
+        self.processed = 0
+        self.inserted = 0
+        self.failures = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "failures": self.failures,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestJobManager:
+    MAX_JOBS = 200
+
+    # Jobs run on threads rather than processes so they share the ingestor's
+    # already-loaded CLIP model; torch releases the GIL during the forward pass.
+    def __init__(self, ingestor, max_workers=1, max_jobs=MAX_JOBS):
+        self.ingestor = ingestor
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+
+    def submit(self, images):
+        job = IngestJob(images)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._evict_finished()
+        # Run in a copy of the submitting request's context so the job's log lines carry its request id
+        self._executor.submit(contextvars.copy_context().run, self._run, job)
+        logging.info(f"Queued ingest job {job.id} with {job.total} images")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _evict_finished(self):
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[job_id].finished:
+                del self.jobs[job_id]
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+
+        def progress(done, total):
+            job.processed = done
+
+        try:
+            summary = self.ingestor.create_vector_db(job.images, progress=progress)
+            job.processed = job.total
+            job.inserted = summary["inserted"]
+            job.failures = summary["failed"]
+            if not job.failures:
+                job.status = "completed"
+            elif job.inserted:
+                job.status = "completed_with_errors"
+            else:
+                job.status = "failed"
+            logging.info(f"Ingest job {job.id} {job.status}: {job.inserted} inserted, {len(job.failures)} failed")
+        except Exception as e:
+            logging.error(f"Ingest job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
@@ -1,20 +1,51 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Request, Depends
 from pydantic import BaseModel
 import os
 from typing import List
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from ingest import VectorIngestor
+from jobs import IngestJobManager
+from vector_index import VectorIndex
+from embedding_cache import point_id_for
+from collection_schema import price_filter
+from query_cache import QueryCache
+from cart_store import create_cart_store
+from connection_manager import ConnectionManager
+from streaming import sse_event, stream_response
+from voice import VoicePipeline, StreamingTranscriber, create_recognizer_backend, parse_audio_format
+from intent_router import IntentRouter, parse_price_range
+from payment_gateway import CircuitOpenError, GatewayError, create_payment_verifier
+import model_registry
+import metrics
 from app import AIVoiceAssistant
 import speech_recognition as sr
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import google.generativeai as genai
 import json
 import uuid
 import logging
-import requests
+import hashlib
+import asyncio
+import time
 from urllib.parse import urlencode
 app = FastAPI()
+metrics.install_request_id_logging()
+
+# PRELOAD_MODELS=1 loads CLIP at import time so a pre-forking server (gunicorn --preload)
+# shares the weights copy-on-write across its workers; otherwise it loads during warmup
+if os.getenv("PRELOAD_MODELS", "0") == "1":
+    model_registry.preload()
+
+# Registered before CORS so CORS stays the outer layer and 503s still carry its headers
+HEALTH_PATHS = {"/", "/healthz", "/readyz", "/metrics"}
+
+@app.middleware("http")
+async def readiness_gate(request: Request, call_next):
+    if not ready and request.url.path not in HEALTH_PATHS:
+        return JSONResponse(status_code=503, content={"detail": "Service is warming up"}, headers={"Retry-After": "5"})
+    return await call_next(request)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,48 +54,100 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# PROFILE_SLOW_REQUESTS_MS=500 profiles 1 in 1/PROFILE_SAMPLE_RATE requests with pyinstrument and
+# writes those slower than the threshold to PROFILE_DIR
+slow_request_profiler = metrics.SlowRequestProfiler.from_env()
+
+# Outermost layer: every request gets an X-Request-ID (the client's if well-formed, else a fresh one) that tags the
+# log lines of each stage, and is counted and timed by route template
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    request_id = metrics.accept_request_id(request.headers.get("X-Request-ID"))
+    token = metrics.request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        with slow_request_profiler.profile(f"{request.method} {request.url.path}"):
+            response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = request.scope.get("endpoint")
+        name = route.path if route is not None else getattr(endpoint, "__name__", "unmatched")
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, route=name)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=name, status=status)
+        metrics.request_id_var.reset(token)
+
 app.mount("/images", StaticFiles(directory="images"), name="images")
 
 image_folder = "./images"
 ingestor = VectorIngestor(image_folder)
+ingest_jobs = IngestJobManager(ingestor, max_workers=int(os.getenv("INGEST_WORKERS", "1")))
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# VECTOR_INDEX=flat|hnsw mirrors image_vectors in process for /query/; "off" always asks Qdrant
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX", "flat")
+VECTOR_INDEX_MAX_AGE = float(os.getenv("VECTOR_INDEX_MAX_AGE", "300"))
+QUERY_TOP_K = int(os.getenv("QUERY_TOP_K", "5"))
+
+vector_index = None
+if VECTOR_INDEX_MODE != "off":
+    vector_index = VectorIndex(VectorIngestor.VECTOR_SIZE, mode=VECTOR_INDEX_MODE, max_age=VECTOR_INDEX_MAX_AGE)
+    ingestor.add_upsert_listener(vector_index.upsert)
+    ingestor.add_delete_listener(vector_index.delete)
+
+query_cache = QueryCache(
+    maxsize=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+)
+ingestor.add_upsert_listener(query_cache.invalidate)
+ingestor.add_delete_listener(query_cache.invalidate)
 
 vector_db_url = "http://localhost:6333"
 api_key = os.getenv("API_KEY")
 if not api_key:
     raise RuntimeError("API_KEY environment variable not set.")
-assistant = AIVoiceAssistant(vector_db_url, api_key)
+# Built during startup warmup rather than at import; see warm_up()
+assistant = None
+ready = False
 
-cart = []
+cart_store = create_cart_store()
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+def get_session_id(request: Request):
+    return request.headers.get("X-Session-Id") or request.cookies.get("session_id") or "default"
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# "async" returns cart mutations immediately and pushes the AI commentary over /ws/cart
+# as an {"action": "ai_response", "correlation_id": ...} message; "sync" inlines it in the response.
+CART_COMMENTARY_MODE = os.getenv("CART_COMMENTARY_MODE", "sync")
+background_tasks = set()
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_message(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
-
-manager = ConnectionManager()
+manager = ConnectionManager(
+    queue_size=int(os.getenv("WS_QUEUE_SIZE", "100")),
+    overflow=os.getenv("WS_OVERFLOW_POLICY", "drop_oldest"),
+)
 
+# Each socket joins the room of its session, so cart notifications only reach that user's tabs
 @app.websocket("/ws/cart")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    session_id = websocket.query_params.get("session_id") or websocket.cookies.get("session_id") or "default"
+    await manager.connect(websocket, room=session_id)
     try:
         while True:
             data = await websocket.receive_text()
-            await manager.send_message(data)
+            await manager.send_message(data, room=session_id)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.get("/ws/stats")
+async def websocket_stats():
+    return manager.stats()
+
 class QueryRequest(BaseModel):
     query_text: str
 
@@ -81,46 +164,200 @@ class RemoveItemRequest(BaseModel):
 async def read_root():
     return {"message": "Welcome to the AI Voice Assistance API"}
 
-@app.post("/ingest/")
+# Fails once warmup has given up, so the orchestrator restarts the process instead of waiting on it forever
+@app.get("/healthz")
+async def healthz():
+    if warmup_error is not None:
+        return JSONResponse(status_code=503, content={"status": "warmup_failed", "detail": warmup_error})
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    if not ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
+def load_models():
+    global assistant
+    model_registry.warmup(ingestor.MODEL_NAME)
+    if assistant is None:
+        assistant = AIVoiceAssistant(vector_db_url, api_key)
+
+# Warmup runs in the background so /healthz answers while models load; /readyz flips once it's done.
+# Failures are retried with exponential backoff, WARMUP_ATTEMPTS times in total.
+WARMUP_ATTEMPTS = int(os.getenv("WARMUP_ATTEMPTS", "5"))
+WARMUP_BACKOFF = float(os.getenv("WARMUP_BACKOFF", "2"))
+warmup_error = None
+
+@app.on_event("startup")
+async def warm_up():
+    async def run():
+        global ready, warmup_error
+        for attempt in range(1, WARMUP_ATTEMPTS + 1):
+            try:
+                await run_in_threadpool(load_models)
+                ready = True
+                logging.info("Service is ready")
+                return
+            except Exception as e:
+                if attempt == WARMUP_ATTEMPTS:
+                    warmup_error = str(e)
+                    logging.error(f"Warmup failed after {attempt} attempts, giving up: {e}")
+                    return
+                delay = WARMUP_BACKOFF * 2 ** (attempt - 1)
+                logging.error(f"Warmup attempt {attempt} failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+
+    task = asyncio.create_task(run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# Hashes while copying so the returned id is the point id ingest will store the image under
+def save_upload(file: UploadFile, file_path: str):
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as buffer:
+        for chunk in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return point_id_for(digest.hexdigest())
+
+@app.post("/ingest/", status_code=202)
 async def ingest_images(files: List[UploadFile] = File(...), descriptions: List[str] = None, prices: List[float] = None):
-    image_metadata = []
     images = []
 
     for idx, file in enumerate(files):
-        file_path = os.path.join(image_folder, file.filename)
-        with open(file_path, 'wb') as buffer:
-            buffer.write(file.file.read())
-        
+        file_name = os.path.basename(file.filename)
+        file_path = os.path.join(image_folder, file_name)
+        try:
+            point_id = await run_in_threadpool(save_upload, file, file_path)
+        except OSError as e:
+            logging.error(f"Error saving upload {file_name}: {e}")
+            raise HTTPException(status_code=500, detail=f"Failed to save {file_name}")
+
         description = descriptions[idx] if descriptions and len(descriptions) > idx else "No description available."
         price = prices[idx] if prices and len(prices) > idx else 0.0
 
-        metadata = {
-            "id": str(uuid.uuid4()),
+        images.append({
+            "id": point_id,
+            "file_name": file_name,
             "description": description,
             "price": price
-        }
-        
-        images.append({
-            "id": metadata["id"],
-            "file_name": file.filename,
-            "description": metadata["description"],
-            "price": metadata["price"]
         })
 
+    job = ingest_jobs.submit(images)
+
+    return {"message": "Image ingestion started", "job_id": job.id, "status_url": f"/ingest/{job.id}", "images": images}
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return job.to_dict()
+
+@app.on_event("shutdown")
+async def shutdown_ingest_jobs():
+    ingest_jobs.shutdown()
+    ingestor.shutdown()
+
+@app.on_event("startup")
+async def load_vector_index():
+    if vector_index is None:
+        return
     try:
-        ingestor.create_vector_db(images)
+        await run_in_threadpool(vector_index.load_from_qdrant, ingestor.client, ingestor.collection_name)
     except Exception as e:
-        logging.error(f"Error during image ingestion: {e}")
-        raise HTTPException(status_code=500, detail="Failed to ingest images")
+        logging.error(f"Error loading vector index, serving /query/ from Qdrant until a retry succeeds: {e}")
 
-    return {"message": "Images ingested successfully", "images": images}
+def search_catalog(query_text: str, price_range=None):
+    return query_cache.get_results(query_text, lambda text: _search_catalog(text, price_range), price_range)
 
-async def query_images(request: QueryRequest):
-    search_results = assistant.query_vector_db(request.query_text)
+def embed_query(query_text: str):
+    with metrics.span("embed"):
+        return query_cache.get_embedding(query_text, ingestor.extract_text_features)
 
-@app.post("/query/")
-async def query_images(request: QueryRequest):
-    search_results = assistant.query_vector_db(request.query_text)
+def _search_catalog(query_text: str, price_range=None):
+    if vector_index is not None:
+        vector_index.ensure_loaded(ingestor.client, ingestor.collection_name)
+    if vector_index is not None and vector_index.ready:
+        if vector_index.is_stale():
+            vector_index.refresh_in_background(ingestor.client, ingestor.collection_name)
+        else:
+            query_vector = embed_query(query_text)
+            with metrics.span("index_search"):
+                results = vector_index.search(query_vector, QUERY_TOP_K, price_range=price_range)
+            if results or price_range is not None:
+                return results
+    if price_range is not None:
+        query_vector = embed_query(query_text)
+        with metrics.span("qdrant_search"):
+            return ingestor.search(query_vector, QUERY_TOP_K, query_filter=price_filter(*price_range))
+    with metrics.span("qdrant_search"):
+        return assistant.query_vector_db(query_text)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return query_cache.stats()
+
+# INTENT_CLASSIFIER=1 falls back to comparing CLIP text embeddings against intent exemplars
+# when none of the intent phrases match
+intent_router = IntentRouter(
+    embed=(lambda text: query_cache.get_embedding(text, ingestor.extract_text_features))
+    if os.getenv("INTENT_CLASSIFIER", "0") == "1" else None,
+    threshold=float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.9")),
+)
+
+@app.get("/intents/stats")
+async def intent_stats():
+    return intent_router.stats.snapshot()
+
+def _cache_stat(field):
+    return lambda: {(tier,): stats[field] for tier, stats in query_cache.stats().items()}
+
+def _ingest_job_counts():
+    counts = {}
+    for job in list(ingest_jobs.jobs.values()):
+        counts[(job.status,)] = counts.get((job.status,), 0) + 1
+    return counts
+
+metrics.REGISTRY.counter("query_cache_hits_total", "Query cache hits", ["tier"], function=_cache_stat("hits"))
+metrics.REGISTRY.counter("query_cache_misses_total", "Query cache misses", ["tier"], function=_cache_stat("misses"))
+metrics.REGISTRY.gauge("query_cache_entries", "Entries held by the query cache", ["tier"], function=_cache_stat("size"))
+metrics.REGISTRY.gauge("vector_index_points", "Points mirrored in the in-process vector index",
+                       function=lambda: len(vector_index) if vector_index is not None else 0)
+metrics.REGISTRY.gauge("ingest_jobs", "Tracked ingest jobs by status", ["status"], function=_ingest_job_counts)
+metrics.REGISTRY.gauge("websocket_connections", "Open /ws/cart connections", function=lambda: manager.stats()["connections"])
+metrics.REGISTRY.gauge("websocket_queue_depth", "Messages waiting in WebSocket send queues",
+                       function=lambda: manager.stats()["queue_depth_total"])
+metrics.REGISTRY.gauge("websocket_queue_depth_max", "Deepest WebSocket send queue",
+                       function=lambda: manager.stats()["queue_depth_max"])
+metrics.REGISTRY.counter("websocket_messages_sent_total", "Messages written to WebSockets",
+                         function=lambda: manager.messages_sent)
+metrics.REGISTRY.counter("websocket_messages_dropped_total", "Messages dropped by the WebSocket overflow policy",
+                         function=lambda: manager.messages_dropped)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+async def resolve_intent(query_text: str):
+    if intent_router.uses_classifier:
+        return await run_in_threadpool(intent_router.route, query_text)
+    return intent_router.route(query_text)
+
+# Routes the query to an intent and runs only the search and cart/checkout/discount work that
+# intent needs; the LLM response is left to the caller
+async def process_query(request: QueryRequest, session_id: str):
+    start = time.perf_counter()
+    with metrics.span("intent_route"):
+        intent = await resolve_intent(request.query_text)
+    intent_router.stats.record(intent.name, "route", time.perf_counter() - start)
+
+    search_results = []
+    price_range = parse_price_range(request.query_text) if intent.needs_search else None
+    if intent.needs_search:
+        with intent_router.timed(intent, "search"):
+            search_results = await run_in_threadpool(search_catalog, request.query_text, price_range)
 
     filtered_images = []
     for result in search_results:
@@ -132,13 +369,14 @@ async def query_images(request: QueryRequest):
 
         filtered_images.append({"id": id, "filename": file_name, "description": description, "price": price})
 
+    action_start = time.perf_counter()
     add_to_cart_item = filtered_images[0] if filtered_images else None
     deleted_from_cart = None
     updated_cart_item = None
     action_result = "no_action"
     payment_url=None
 
-    if "add to cart" in request.query_text.lower():
+    if intent.name == "add_to_cart":
         if filtered_images:
             add_to_cart_item = filtered_images[0]
             cart_item = CartItem(
@@ -147,22 +385,22 @@ async def query_images(request: QueryRequest):
                 price=add_to_cart_item["price"],
                 quantity=1,
             )
-            cart.append(cart_item)
+            await run_in_threadpool(cart_store.add_item, session_id, cart_item.model_dump())
             action_result = "added_to_cart"
 
             notification = {"action": "add", "item": cart_item.model_dump()}
-            await manager.send_message(json.dumps(notification))
+            await manager.send_message(json.dumps(notification), room=session_id)
 
-    elif "delete from cart" in request.query_text.lower():
+    elif intent.name == "delete_from_cart":
         if filtered_images:
             deleted_from_cart = filtered_images[0]
-            await remove_item_from_cart_internal(deleted_from_cart["description"])
+            await remove_item_from_cart_internal(session_id, deleted_from_cart["description"])
             action_result = "deleted_from_cart"
 
             notification = {"action": "remove", "item": deleted_from_cart["description"]}
-            await manager.send_message(json.dumps(notification))
+            await manager.send_message(json.dumps(notification), room=session_id)
 
-    elif "update cart" in request.query_text.lower():
+    elif intent.name == "update_cart":
         if filtered_images:
             updated_cart_item = filtered_images[0]
             cart_item = CartItem(
@@ -171,146 +409,242 @@ async def query_images(request: QueryRequest):
                 price=updated_cart_item["price"],
                 quantity=1,  
             )
-            await edit_cart_item(cart_item)
+            await edit_cart_item_internal(session_id, cart_item)
             action_result = "updated_cart"
 
             notification = {"action": "edit", "item": cart_item.model_dump()}
-            await manager.send_message(json.dumps(notification))
-    elif "proceed to check out" in request.query_text.lower():
-     if cart:
-        total_amount = sum(item.price * item.quantity for item in cart)
+            await manager.send_message(json.dumps(notification), room=session_id, coalesce_key=f"edit:{cart_item.description}")
+    elif intent.name == "checkout":
+     cart = await run_in_threadpool(cart_store.items, session_id)
+     if cart and intent.needs_payment:
+        total_amount = sum(item["price"] * item["quantity"] for item in cart)
         
+        discount_state = await run_in_threadpool(cart_store.discount, session_id)
         if discount_state["bargaining_attempts"] > 0:
             discount = discount_state.get("current_discount", 0)  
             total_amount *= (1 - discount / 100)  
         
-        product_ids = ', '.join(item.id for item in cart)
+        product_ids = ', '.join(item["id"] for item in cart)
         payment_request = PaymentRequest(amount=total_amount, product_id=product_ids)
         
-        payment_response = await esewa_payment(payment_request)
+        with intent_router.timed(intent, "payment"), metrics.span("payment"):
+            payment_response = await esewa_payment(payment_request, session_id)
         payment_url = payment_response.get('url')  
         
         if payment_url:
             action_result = "proceed_to_checkout"
             notification = {"action": "checkout", "url": payment_url}
-            await manager.send_message(json.dumps(notification))
-            cart.clear()
+            await manager.send_message(json.dumps(notification), room=session_id)
+            await run_in_threadpool(cart_store.clear, session_id)
         else:
             action_result = "payment_failed"
 
     
-    elif "provide me discount" in request.query_text.lower():
-        discount_state["bargaining_attempts"] += 1
-        new_discount = handle_bargaining()
-
-        if discount_state["bargaining_attempts"]> 0 and discount_state["current_discount"]<discount_state["max_discount"]:
-          discount_state["current_discount"] +=2
-          discount_state["current_discount"] = new_discount 
+    elif intent.name == "discount":
+        new_discount = (await run_in_threadpool(cart_store.bargain, session_id))["current_discount"]
 
-        total_amount = sum(item.price * item.quantity for item in cart)
+        total_amount = sum(item["price"] * item["quantity"] for item in await run_in_threadpool(cart_store.items, session_id))
         discounted_amount = total_amount * (1 - new_discount / 100)
 
 
         action_result = "discount_applied"
         notification = {"action": "discount", "discount": new_discount, "final_amount": discounted_amount}
-        await manager.send_message(json.dumps(notification))
+        await manager.send_message(json.dumps(notification), room=session_id, coalesce_key="discount")
 
 
 
-    response = assistant.generate_response(request.query_text, action_result)
-
-    return {
-        "response": response,
+    result = {
         "images": filtered_images,
         "addToCart": add_to_cart_item if action_result == "added_to_cart" else None,
         "deleteFromCart": deleted_from_cart if action_result == "deleted_from_cart" else None,
         "updateCart": updated_cart_item if action_result == "updated_cart" else None,
         "paymentUrl": payment_url if action_result == "proceed_to_checkout" else None,
         "discountApplied": discounted_amount if action_result == "discount_applied" else None,
+        "priceFilter": {"gte": price_range[0], "lte": price_range[1]} if price_range else None,
     }
+    metrics.STAGE_LATENCY.observe(time.perf_counter() - action_start, stage=f"intent_{intent.name}")
+    intent_router.stats.record(intent.name, "process", time.perf_counter() - start)
+    return result, action_result, intent
+
+@app.post("/query/")
+async def query_images(request: QueryRequest, session_id: str = Depends(get_session_id)):
+    result, action_result, intent = await process_query(request, session_id)
+    response = None
+    if intent.needs_llm:
+        with intent_router.timed(intent, "llm"), metrics.span("llm"):
+            response = await run_in_threadpool(assistant.generate_response, request.query_text, action_result)
+    return {"response": response, **result}
+
+# Same as /query/, but sent as Server-Sent Events: a "results" event with the search results and
+# cart action as soon as they are ready, then "token" events as the LLM answer is generated
+@app.post("/query/stream")
+async def query_images_stream(request: QueryRequest, session_id: str = Depends(get_session_id)):
+    result, action_result, intent = await process_query(request, session_id)
+
+    async def events():
+        yield sse_event("results", result)
+        try:
+            if intent.needs_llm:
+                with intent_router.timed(intent, "llm"), metrics.span("llm_stream"):
+                    async for chunk in stream_response(assistant, request.query_text, action_result):
+                        yield sse_event("token", {"text": chunk})
+        except Exception as e:
+            logging.error(f"Error streaming response: {e}")
+            yield sse_event("error", {"detail": "Failed to generate response"})
+            return
+        yield sse_event("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def remove_item_from_cart_internal(session_id: str, description: str):
+    await run_in_threadpool(cart_store.remove_by_description, session_id, description)
+
+voice_pipeline = VoicePipeline(
+    create_recognizer_backend(),
+    max_workers=int(os.getenv("VOICE_WORKERS", "2")),
+    max_pending=int(os.getenv("VOICE_MAX_PENDING", "8")),
+)
 
-async def remove_item_from_cart_internal(description: str):
-    global cart
-    cart = [item for item in cart if item.description.lower() != description.lower()]
+@app.on_event("shutdown")
+async def shutdown_voice_pipeline():
+    voice_pipeline.shutdown()
 
 @app.post("/voice-query")
 async def voice_query(file: UploadFile = File(...)):
-    recognizer = sr.Recognizer()
-    audio_file_path = os.path.join("audio", file.filename)
+    data = await file.read()
 
     try:
-        with open(audio_file_path, "wb") as buffer:
-            buffer.write(file.file.read())
+        with metrics.span("stt"):
+            query_text = await voice_pipeline.transcribe(data)
+        with metrics.span("assistant"):
+            response = await voice_pipeline.run(assistant.handle_user_query, query_text)
+
+        return {"response": response, "query_text": query_text}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Unsupported audio format; {e}")
+    except sr.UnknownValueError:
+        raise HTTPException(status_code=400, detail="Could not understand the audio.")
+    except sr.RequestError as e:
+        raise HTTPException(status_code=500, detail=f"Could not request results from the speech recognition service; {e}")
+
+# Clients stream raw mono PCM as binary frames (sample_rate/sample_width query params) and send
+# the text frame "end" when the user stops speaking. Partial transcripts are pushed while audio
+# is still arriving, followed by a final transcript with the assistant's response.
+@app.websocket("/ws/voice")
+async def voice_stream(websocket: WebSocket):
+    await websocket.accept()
+    if not ready:
+        # 1013 "try again later", the WebSocket counterpart of the readiness gate's 503
+        await websocket.close(code=1013, reason="Service is warming up")
+        return
+    params = websocket.query_params
+    try:
+        sample_rate, sample_width = parse_audio_format(params.get("sample_rate", 16000), params.get("sample_width", 2))
+    except ValueError as e:
+        # 1003: the client sent audio in a format we can't accept
+        await websocket.close(code=1003, reason=str(e)[:120])
+        return
+    transcriber = StreamingTranscriber(voice_pipeline, sample_rate=sample_rate, sample_width=sample_width)
+    partial_sender = None
+
+    async def send_partial(task):
+        text = await task
+        if text:
+            await websocket.send_json({"type": "partial", "text": text})
 
-        with sr.AudioFile(audio_file_path) as source:
-            audio = recognizer.record(source)
-            try:
-                query_text = recognizer.recognize_google(audio)
-                response = assistant.handle_user_query(query_text)
-               
-                return {"response": response, "query_text": query_text}
-            except sr.UnknownValueError:
-                raise HTTPException(status_code=400, detail="Could not understand the audio.")
-            except sr.RequestError as e:
-                raise HTTPException(status_code=500, detail=f"Could not request results from the speech recognition service; {e}")
+    try:
+        while not transcriber.full:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                task = transcriber.feed(message["bytes"])
+                if task is not None:
+                    partial_sender = asyncio.create_task(send_partial(task))
+            elif message.get("text") == "end":
+                break
+
+        if partial_sender is not None:
+            partial_sender.cancel()
+        try:
+            with metrics.span("stt"):
+                query_text = await transcriber.finish()
+            with metrics.span("assistant"):
+                response = await voice_pipeline.run(assistant.handle_user_query, query_text)
+            await websocket.send_json({"type": "final", "query_text": query_text, "response": response})
+        except sr.UnknownValueError:
+            await websocket.send_json({"type": "error", "detail": "Could not understand the audio."})
+        except sr.RequestError as e:
+            await websocket.send_json({"type": "error", "detail": f"Could not request results from the speech recognition service; {e}"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
     finally:
-        if os.path.exists(audio_file_path):
-            os.remove(audio_file_path)
+        if partial_sender is not None:
+            partial_sender.cancel()
 
 @app.get("/cart/")
-async def get_cart():
-    return {"cart": [item.dict() for item in cart]}
+async def get_cart(session_id: str = Depends(get_session_id)):
+    return {"cart": await run_in_threadpool(cart_store.items, session_id)}
+
+async def cart_ai_response(session_id: str, query_text: str, action_result: str):
+    if CART_COMMENTARY_MODE != "async":
+        query_request = QueryRequest(query_text=query_text)
+        return {"ai_response": await query_images(query_request, session_id)}
+
+    correlation_id = str(uuid.uuid4())
+    task = asyncio.create_task(push_cart_commentary(session_id, correlation_id, query_text, action_result))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return {"correlation_id": correlation_id}
+
+async def push_cart_commentary(session_id: str, correlation_id: str, query_text: str, action_result: str):
+    notification = {"action": "ai_response", "correlation_id": correlation_id}
+    try:
+        with metrics.span("llm"):
+            notification["response"] = await run_in_threadpool(assistant.generate_response, query_text, action_result)
+    except Exception as e:
+        logging.error(f"Error generating cart commentary {correlation_id}: {e}")
+        notification["error"] = "Failed to generate response"
+    await manager.send_message(json.dumps(notification), room=session_id)
 
 @app.post("/cart/add")
-async def add_cart_item(item: CartItem):
-    global cart
-    existing_item = next((i for i in cart if i.description.lower() == item.description.lower()), None)
-    if existing_item:
-        existing_item.quantity += item.quantity
-    else:
-        cart.append(item)
+async def add_cart_item(item: CartItem, session_id: str = Depends(get_session_id)):
+    await run_in_threadpool(cart_store.add_item, session_id, item.model_dump())
 
     notification = {"action": "add", "item": item.model_dump()}
-    await manager.send_message(json.dumps(notification))
-    
-    query_request = QueryRequest(query_text=f"Added {item.description} to cart")
-    response = await query_images(query_request)
+    await manager.send_message(json.dumps(notification), room=session_id)
 
-    return {"message": "Item added to cart", "ai_response": response}
+    ai_response = await cart_ai_response(session_id, f"Added {item.description} to cart", "added_to_cart")
+
+    return {"message": "Item added to cart", **ai_response}
     
 
 @app.post("/cart/remove")
-async def delete_item_from_cart(item: RemoveItemRequest):
-    global cart
-    cart = [i for i in cart if i.description.lower() != item.description.lower()]
+async def delete_item_from_cart(item: RemoveItemRequest, session_id: str = Depends(get_session_id)):
+    await remove_item_from_cart_internal(session_id, item.description)
 
     notification = {"action": "remove", "item": item.description}
-    await manager.send_message(json.dumps(notification))
+    await manager.send_message(json.dumps(notification), room=session_id)
+
+    ai_response = await cart_ai_response(session_id, f"Removed {item.description} from cart", "deleted_from_cart")
 
-    query_request = QueryRequest(query_text=f"Removed {item.description} from cart")
-    response = await query_images(query_request)
+    return {"message": "Item removed from cart", **ai_response}
 
-    return {"message": "Item removed from cart", "ai_response": response}
+async def edit_cart_item_internal(session_id: str, updated_item: CartItem):
+    await run_in_threadpool(cart_store.set_item, session_id, updated_item.model_dump())
 
 @app.post("/cart/edit/")
-async def edit_cart_item(updated_item: CartItem):
-    global cart
-    found = False
-    for item in cart:
-        if item.description.lower() == updated_item.description.lower():
-            item.quantity = updated_item.quantity
-            found = True
-            break
-    if not found:
-        cart.append(updated_item)
+async def edit_cart_item(updated_item: CartItem, session_id: str = Depends(get_session_id)):
+    await edit_cart_item_internal(session_id, updated_item)
 
     notification = {"action": "edit", "item": updated_item.model_dump()}
-    await manager.send_message(json.dumps(notification))
+    await manager.send_message(json.dumps(notification), room=session_id, coalesce_key=f"edit:{updated_item.description}")
 
-    query_request = QueryRequest(query_text=f"Removed {updated_item.description} from cart")
-    response = await query_images(query_request)
+    ai_response = await cart_ai_response(session_id, f"Updated {updated_item.description} in cart", "updated_cart")
 
-    return {"message": "Item updated from cart", "ai_response": response}
+    return {"message": "Item updated from cart", **ai_response}
 
 class PaymentRequest(BaseModel):
     amount: float
@@ -318,9 +652,9 @@ class PaymentRequest(BaseModel):
 
 
 @app.post("/esewa-payment")
-async def esewa_payment(payment: PaymentRequest):
+async def esewa_payment(payment: PaymentRequest, session_id: str = Depends(get_session_id)):
     total_amount = payment.amount
-    final_discount = discount_state["current_discount"]
+    final_discount = (await run_in_threadpool(cart_store.discount, session_id))["current_discount"]
     discounted_amount = total_amount * (1 - final_discount / 100)
 
     merchant_code = 'EPAYTEST'
@@ -349,35 +683,32 @@ async def esewa_payment(payment: PaymentRequest):
     }
 
 
-@app.post("/esewa-verify")
-async def esewa_verify(amount: float, product_id: str, ref_id: str):
-    merchant_code = 'EPAYTEST'  
+# PAYMENT_GATEWAY=local swaps eSewa for an in-process stand-in; see payment_gateway
+payment_verifier = create_payment_verifier()
 
-    params = {
-        'amt': amount,
-        'rid': ref_id,  
-        'pid': product_id,  
-        'scd': merchant_code
-    }
+metrics.REGISTRY.gauge("payment_circuit_open", "1 while the payment gateway circuit breaker rejects calls",
+                       function=lambda: 1 if payment_verifier.breaker.state == "open" else 0)
 
-    esewa_verification_url = 'https://uat.esewa.com.np/epay/transrec'
-    
+@app.on_event("shutdown")
+async def close_payment_gateway():
+    await payment_verifier.aclose()
+
+@app.post("/esewa-verify")
+async def esewa_verify(amount: float, product_id: str, ref_id: str):
     try:
-        response = requests.post(esewa_verification_url, data=params)
-        if 'Success' in response.text:
-            return {"message": "Payment verified successfully"}
-        else:
-            raise HTTPException(status_code=400, detail="Payment verification failed")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-discount_state={
-    "current_discount":10,
-    "max_discount":20,
-    "bargaining_attempts": 0
-}
-
-def handle_bargaining():
-    if discount_state["bargaining_attempts"]> 0 and discount_state["current_discount"]<discount_state["max_discount"]:
-        discount_state["current_discount"] +=2
-    return discount_state["current_discount"]    
\ No newline at end of file
+        with metrics.span("payment_verify"):
+            verified = await payment_verifier.verify(amount, product_id, ref_id)
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Payment gateway is unavailable, try again shortly",
+                            headers={"Retry-After": str(int(payment_verifier.breaker.reset_timeout))})
+    except GatewayError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    if not verified:
+        raise HTTPException(status_code=400, detail="Payment verification failed")
+    return {"message": "Payment verified successfully"}
+
+@app.get("/esewa-verify/stats")
+async def esewa_verify_stats():
+    return payment_verifier.stats()
+    
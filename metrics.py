@@ -0,0 +1,264 @@
+import bisect
+import contextvars
+import logging
+import math
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# Tags every log line with the id of the request (or ingest job) that produced it
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Request ids end up in log lines and profile file names, so client-supplied ones are restricted to these
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+# The client's id if it is safe to log and to use as a file name, otherwise a fresh one
+def accept_request_id(value):
+    if value and REQUEST_ID_PATTERN.fullmatch(value) and value not in (".", ".."):
+        return value
+    return new_request_id()
+
+
+# Every record gets a request_id attribute, so any handler's format string can use %(request_id)s
+def install_request_id_logging(fmt="%(levelname)s:%(name)s:[%(request_id)s] %(message)s"):
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "adds_request_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.request_id = request_id_var.get()
+        return record
+
+    record_factory.adds_request_id = True
+    logging.setLogRecordFactory(record_factory)
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(fmt))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    # Values are either recorded through the subclass methods, or read from `function` at
+    # scrape time. A function returns a number, or a dict mapping label value tuples to numbers.
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        if self.function is None:
+            with self._lock:
+                values = dict(self._values)
+        else:
+            try:
+                value = self.function()
+            except Exception as e:
+                logging.error(f"Error collecting {self.name}: {e}")
+                return []
+            values = value if isinstance(value, dict) else {(): value}
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    # Prometheus text exposition format, version 0.0.4
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency until response headers", ["method", "route"])
+STAGE_LATENCY = REGISTRY.histogram("stage_duration_seconds", "Latency of individual request and ingest stages", ["stage"])
+INGEST_IMAGES = REGISTRY.counter("ingest_images_total", "Images processed by ingest, by outcome", ["result"])
+INGEST_RATE = REGISTRY.gauge("ingest_images_per_second", "Embedding throughput of the most recent ingest")
+WS_SEND_LATENCY = REGISTRY.histogram("websocket_send_duration_seconds", "Time to write one message to a WebSocket",
+                                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+# Times one stage into stage_duration_seconds and logs it at debug level under the current request id
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        logging.debug(f"{stage} took {elapsed * 1000:.1f}ms")
+
+
+class SlowRequestProfiler:
+    # Samples a fraction of requests with pyinstrument and keeps an HTML profile of those
+    # that take longer than threshold_ms. Disabled when pyinstrument isn't installed.
+
+    def __init__(self, threshold_ms=None, sample_rate=1.0, output_dir="./profiles", interval=0.001):
+        if threshold_ms and Profiler is None:
+            logging.warning("pyinstrument is not installed, slow request profiling is disabled")
+        self.threshold = threshold_ms / 1000 if threshold_ms and Profiler is not None else None
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.interval = interval
+        self._counter = 0
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            threshold_ms=float(os.getenv("PROFILE_SLOW_REQUESTS_MS", "0")) or None,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.1")),
+            output_dir=os.getenv("PROFILE_DIR", "./profiles"),
+        )
+
+    def _sampled(self):
+        # Deterministic 1-in-N sampling so the overhead is predictable
+        self._counter += 1
+        return self.sample_rate > 0 and self._counter % max(1, round(1 / self.sample_rate)) == 0
+
+    @contextmanager
+    def profile(self, name):
+        if not self.enabled or not self._sampled():
+            yield
+            return
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                os.makedirs(self.output_dir, exist_ok=True)
+                path = os.path.join(self.output_dir, f"{request_id_var.get()}.html")
+                with open(path, "w") as f:
+                    f.write(profiler.output_html())
+                logging.warning(f"Slow request {name} took {elapsed * 1000:.0f}ms, profile written to {path}")
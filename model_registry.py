@@ -0,0 +1,65 @@
+import gc
+import logging
+import os
+import threading
+import time
+from PIL import Image
+from transformers import CLIPModel, CLIPProcessor
+from inference_backends import configure_threads, create_backend
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+# torch | torch-int8 | onnx, see inference_backends
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch")
+CLIP_NUM_THREADS = int(os.getenv("CLIP_NUM_THREADS", "0")) or None
+CLIP_INTEROP_THREADS = int(os.getenv("CLIP_INTEROP_THREADS", "0")) or None
+
+_models = {}
+_backends = {}
+_lock = threading.RLock()
+
+
+# One (model, processor) pair per model name per process, loaded on first use
+def get_clip(model_name=CLIP_MODEL_NAME):
+    with _lock:
+        if model_name not in _models:
+            start = time.perf_counter()
+            model = CLIPModel.from_pretrained(model_name).eval()
+            processor = CLIPProcessor.from_pretrained(model_name)
+            _models[model_name] = (model, processor)
+            logging.info(f"Loaded {model_name} in {time.perf_counter() - start:.2f}s")
+        return _models[model_name]
+
+
+# The inference backend that runs the image and text towers, built once per (model, backend)
+def get_backend(model_name=CLIP_MODEL_NAME, backend=None):
+    backend = backend or CLIP_BACKEND
+    with _lock:
+        if (model_name, backend) not in _backends:
+            if not _backends:
+                configure_threads(CLIP_NUM_THREADS, CLIP_INTEROP_THREADS)
+            model, _ = get_clip(model_name)
+            start = time.perf_counter()
+            _backends[(model_name, backend)] = create_backend(backend, model, model_name, num_threads=CLIP_NUM_THREADS)
+            logging.info(f"Initialised {backend} backend for {model_name} in {time.perf_counter() - start:.2f}s")
+        return _backends[(model_name, backend)]
+
+
+# Call in the parent before workers fork (e.g. gunicorn --preload) so they share the
+# weight pages copy-on-write. Freezing the GC keeps collections in the children from
+# touching, and therefore copying, the pages that hold the preloaded objects.
+def preload(model_name=CLIP_MODEL_NAME):
+    get_backend(model_name)
+    gc.collect()
+    gc.freeze()
+
+
+# Runs one dummy forward pass through both towers so the first real request doesn't pay
+# for lazy kernel initialisation and allocator growth
+def warmup(model_name=CLIP_MODEL_NAME):
+    _, processor = get_clip(model_name)
+    backend = get_backend(model_name)
+    start = time.perf_counter()
+    inputs = processor(text=["warmup"], images=Image.new("RGB", (224, 224)), return_tensors="np", padding=True)
+    backend.image_features(inputs['pixel_values'])
+    backend.text_features(inputs['input_ids'], inputs['attention_mask'])
+    logging.info(f"Warmed up {model_name} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import httpx
+from query_cache import TTLCache
+
+
+class GatewayError(Exception):
+    pass
+
+
+class CircuitOpenError(GatewayError):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    # seconds. After that a single trial call is let through (half-open); its outcome closes the
+    # circuit again or re-opens it for another timeout.
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._trial_in_flight:
+                logging.warning(f"Payment gateway circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class EsewaGateway:
+    # One pooled keep-alive client for every verification. Timeouts and 5xx responses are
+    # retried with jittered exponential backoff; anything still failing raises GatewayError.
+    # httpx timeouts only bound each connect/read/write phase, so every attempt is also capped
+    # at `timeout` seconds overall, and the whole call, retries included, at `deadline`.
+    VERIFY_URL = "https://uat.esewa.com.np/epay/transrec"
+
+    def __init__(self, verify_url=VERIFY_URL, merchant_code="EPAYTEST", timeout=5.0, connect_timeout=2.0,
+                 retries=2, backoff=0.2, deadline=10.0, max_connections=20, max_keepalive=10, keepalive_expiry=30.0):
+        self.verify_url = verify_url
+        self.merchant_code = merchant_code
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=keepalive_expiry),
+        )
+
+    async def verify(self, amount, product_id, ref_id):
+        try:
+            return await asyncio.wait_for(self._verify_with_retries(amount, product_id, ref_id), self.deadline)
+        except asyncio.TimeoutError as e:
+            raise GatewayError(f"eSewa verification of {ref_id} did not complete within {self.deadline}s") from e
+
+    async def _verify_with_retries(self, amount, product_id, ref_id):
+        params = {'amt': amount, 'rid': ref_id, 'pid': product_id, 'scd': self.merchant_code}
+        for attempt in range(self.retries + 1):
+            try:
+                try:
+                    response = await asyncio.wait_for(self.client.post(self.verify_url, data=params), self.timeout)
+                except asyncio.TimeoutError:
+                    raise GatewayError(f"eSewa did not respond within {self.timeout}s")
+                if response.status_code >= 500:
+                    raise GatewayError(f"eSewa returned HTTP {response.status_code}")
+                return 'Success' in response.text
+            except (httpx.TransportError, GatewayError) as e:
+                if attempt == self.retries:
+                    raise GatewayError(f"eSewa verification failed after {attempt + 1} attempts: {e}") from e
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"eSewa verification of {ref_id} failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class LocalGateway:
+    # Stand-in for tests and local development. Every ref_id verifies unless `verified_refs`
+    # is given, in which case only those do; `latency` seconds are spent per call and
+    # `fail_rate` of calls raise GatewayError.
+
+    def __init__(self, latency=0.0, verified_refs=None, fail_rate=0.0):
+        self.latency = latency
+        self.verified_refs = set(verified_refs) if verified_refs is not None else None
+        self.fail_rate = fail_rate
+        self.calls = 0
+
+    async def verify(self, amount, product_id, ref_id):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise GatewayError("Local gateway failure")
+        return self.verified_refs is None or ref_id in self.verified_refs
+
+    async def aclose(self):
+        pass
+
+
+class PaymentVerifier:
+    # Wraps a gateway with a circuit breaker and an idempotency cache keyed by ref_id.
+    # Successful verifications are remembered for `verified_ttl` and rejections for the
+    # shorter `rejected_ttl`, since eSewa may not have settled a payment yet. A cached result
+    # is only reused when the amount and product match the original call, and concurrent
+    # checks of the same ref_id share a single gateway call.
+
+    def __init__(self, gateway, breaker=None, verified_ttl=3600.0, rejected_ttl=30.0, maxsize=10000):
+        self.gateway = gateway
+        self.breaker = breaker or CircuitBreaker()
+        self.verified = TTLCache(maxsize, verified_ttl)
+        self.rejected = TTLCache(maxsize, rejected_ttl)
+        self._in_flight = {}
+
+    async def verify(self, amount, product_id, ref_id):
+        request = (product_id, float(amount))
+        for cache, result in ((self.verified, True), (self.rejected, False)):
+            if cache.get(ref_id) == request:
+                return result
+
+        entry = self._in_flight.get(ref_id)
+        if entry is None or entry[0] != request:
+            task = asyncio.ensure_future(self._verify(amount, product_id, ref_id, request))
+            entry = self._in_flight[ref_id] = (request, task)
+            task.add_done_callback(lambda _, entry=entry: self._forget(ref_id, entry))
+        # Shielded so a client that disconnects doesn't cancel a check other callers are waiting on
+        return await asyncio.shield(entry[1])
+
+    def _forget(self, ref_id, entry):
+        if self._in_flight.get(ref_id) is entry:
+            del self._in_flight[ref_id]
+
+    async def _verify(self, amount, product_id, ref_id, request):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Payment gateway circuit is open")
+        try:
+            verified = await self.gateway.verify(amount, product_id, ref_id)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        (self.verified if verified else self.rejected).set(ref_id, request)
+        return verified
+
+    def stats(self):
+        return {"circuit": self.breaker.state, "failures": self.breaker.failures,
+                "verified": self.verified.stats(), "rejected": self.rejected.stats()}
+
+    async def aclose(self):
+        await self.gateway.aclose()
+
+
+# PAYMENT_GATEWAY=esewa talks to eSewa (ESEWA_VERIFY_URL, defaults to UAT); "local" uses LocalGateway
+def create_payment_verifier(name=None):
+    name = name or os.getenv("PAYMENT_GATEWAY", "esewa")
+    if name == "esewa":
+        gateway = EsewaGateway(
+            verify_url=os.getenv("ESEWA_VERIFY_URL", EsewaGateway.VERIFY_URL),
+            merchant_code=os.getenv("ESEWA_MERCHANT_CODE", "EPAYTEST"),
+            timeout=float(os.getenv("PAYMENT_TIMEOUT", "5")),
+            retries=int(os.getenv("PAYMENT_RETRIES", "2")),
+            deadline=float(os.getenv("PAYMENT_DEADLINE", "10")),
+        )
+    elif name == "local":
+        gateway = LocalGateway(latency=float(os.getenv("LOCAL_PAYMENT_LATENCY", "0")))
+    else:
+        raise ValueError(f"Unknown PAYMENT_GATEWAY: {name}")
+    breaker = CircuitBreaker(
+        failure_threshold=int(os.getenv("PAYMENT_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("PAYMENT_BREAKER_RESET", "30")),
+    )
+    return PaymentVerifier(gateway, breaker)
@@ -0,0 +1,148 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from PIL import Image
+
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+
+def load_image(path, size=CLIP_IMAGE_SIZE):
+    image = Image.open(path)
+    # For JPEGs, draft mode makes libjpeg decode at 1/2, 1/4 or 1/8 scale while keeping
+    # both sides >= size, so large product photos skip most of the full-size decode
+    image.draft("RGB", (size, size))
+    return image.convert("RGB")
+
+
+# Same transform as CLIPProcessor: bicubic resize of the shortest side, centre crop, normalise.
+# Returns a (3, size, size) float32 array ready to be stacked into pixel_values.
+def preprocess_image(path, size=CLIP_IMAGE_SIZE):
+    image = load_image(path, size)
+    width, height = image.size
+    scale = size / min(width, height)
+    image = image.resize((max(size, round(width * scale)), max(size, round(height * scale))), Image.BICUBIC)
+    left = (image.width - size) // 2
+    top = (image.height - size) // 2
+    image = image.crop((left, top, left + size, top + size))
+    pixels = (np.asarray(image, dtype=np.float32) / 255.0 - CLIP_MEAN) / CLIP_STD
+    return pixels.transpose(2, 0, 1)
+
+
+def _preprocess_worker(path, size):
+    try:
+        return path, preprocess_image(path, size), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+class PreprocessPipeline:
+    # Decodes and preprocesses images in a process pool and hands ready-made pixel batches
+    # to the caller through a bounded queue. A feeder thread keeps at most `queue_batches`
+    # batches waiting plus one batch of work in flight, so decode overlaps with inference
+    # without buffering the whole catalog in memory.
+    #
+    # The pool is started on first use and reused by every later call until shutdown().
+    # Workers are spawned rather than forked, so they don't inherit a copy of the parent's
+    # loaded models or locks held by its other threads.
+
+    def __init__(self, workers=None, batch_size=32, queue_batches=4, size=CLIP_IMAGE_SIZE, start_method="spawn"):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue_batches = queue_batches
+        self.size = size
+        self.start_method = start_method
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(self.start_method))
+            return self._pool
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # Yields (paths, pixel_values, failures) where failures is a list of (path, error)
+    def iter_batches(self, image_paths):
+        batches = queue.Queue(maxsize=self.queue_batches)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def feed():
+            paths, rows, failures = [], [], []
+            in_flight = deque()
+            pool = self._get_pool()
+            try:
+                pending = iter(image_paths)
+                while not stop.is_set():
+                    while len(in_flight) < self.batch_size + self.workers:
+                        path = next(pending, None)
+                        if path is None:
+                            break
+                        in_flight.append(pool.submit(_preprocess_worker, path, self.size))
+                    if not in_flight:
+                        break
+                    path, pixels, error = in_flight.popleft().result()
+                    if error is None:
+                        paths.append(path)
+                        rows.append(pixels)
+                    else:
+                        logging.error(f"Error preprocessing {path}: {error}")
+                        failures.append((path, error))
+                    if len(paths) + len(failures) >= self.batch_size:
+                        if not put((paths, np.stack(rows) if rows else None, failures)):
+                            return
+                        paths, rows, failures = [], [], []
+                if paths or failures:
+                    put((paths, np.stack(rows) if rows else None, failures))
+            except Exception as e:
+                # A worker died; start a fresh pool for the next call
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_pool(pool)
+                put(e)
+            finally:
+                for future in in_flight:
+                    future.cancel()
+                put(done)
+
+        feeder = threading.Thread(target=feed, name="preprocess-feeder", daemon=True)
+        feeder.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            feeder.join()
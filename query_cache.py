@@ -0,0 +1,91 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_PUNCTUATION = re.compile(r"[^\w\s$.]")
+
+
+def normalize_query(text):
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+
+class TTLCache:
+    # Bounded LRU map whose entries also expire `ttl` seconds after they were stored
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+class QueryCache:
+    # Two tiers keyed on normalised query text: text embeddings, which only depend on
+    # the model, and top-k search results, which are dropped whenever the collection changes.
+    # Results are also keyed on any filter the caller applied, so normalisation can't make
+    # two queries with different filters share an entry.
+
+    def __init__(self, maxsize=1024, ttl=300.0, embedding_maxsize=4096, embedding_ttl=3600.0):
+        self.embeddings = TTLCache(embedding_maxsize, embedding_ttl)
+        self.results = TTLCache(maxsize, ttl)
+        self._generation = 0
+
+    def get_embedding(self, text, compute):
+        key = normalize_query(text)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            vector = compute(text)
+            self.embeddings.set(key, vector)
+        return vector
+
+    def get_results(self, text, compute, filters=None):
+        key = (normalize_query(text), filters)
+        results = self.results.get(key)
+        if results is None:
+            generation = self._generation
+            results = compute(text)
+            # Don't store results computed against a collection that changed mid-search
+            if generation == self._generation:
+                self.results.set(key, results)
+        return results
+
+    # Signature matches VectorIngestor upsert listeners
+    def invalidate(self, *args):
+        self._generation += 1
+        self.results.clear()
+
+    def stats(self):
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
@@ -0,0 +1,48 @@
+import asyncio
+import json
+import threading
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Yields the assistant's answer as text chunks. Assistants that expose a
+# generate_response_stream(query_text, action_result) generator are streamed token
+# by token from a worker thread; otherwise the full generate_response result is
+# yielded as a single chunk.
+async def stream_response(assistant, query_text, action_result):
+    generate_stream = getattr(assistant, "generate_response_stream", None)
+    loop = asyncio.get_running_loop()
+
+    if generate_stream is None:
+        yield await loop.run_in_executor(None, assistant.generate_response, query_text, action_result)
+        return
+
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for chunk in generate_stream(query_text, action_result):
+                if cancelled.is_set():
+                    break
+                if chunk:
+                    loop.call_soon_threadsafe(queue.put_nowait, ("token", chunk))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "done":
+                break
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        # Client went away or we finished; stop pulling tokens from the model
+        cancelled.set()
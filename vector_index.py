@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Mirrors the fields of qdrant's ScoredPoint that callers actually read
+IndexHit = namedtuple("IndexHit", ["id", "score", "payload"])
+
+
+class VectorIndex:
+    # In-process copy of a Qdrant collection: a contiguous, L2-normalised float32
+    # matrix searched with a single matrix-vector product, or an HNSW graph when
+    # mode="hnsw" and hnswlib is installed.
+    #
+    # Loads scroll the collection without holding the lock, so upserts and deletes that
+    # arrive meanwhile are journaled and replayed onto the new arrays before they are
+    # swapped in; otherwise a refresh could drop new points or resurrect deleted ones.
+
+    SCROLL_BATCH_SIZE = 1024
+
+    def __init__(self, dim=512, mode="flat", max_age=300.0, hnsw_m=16, hnsw_ef_construction=200, hnsw_ef=64,
+                 retry_interval=10.0):
+        if mode == "hnsw" and hnswlib is None:
+            logging.warning("hnswlib is not installed, falling back to flat vector index")
+            mode = "flat"
+        self.dim = dim
+        self.mode = mode
+        self.max_age = max_age
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef = hnsw_ef
+        self.retry_interval = retry_interval
+        self.loaded_at = None
+        self._last_attempt = 0.0
+
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._ids = []
+        self._payloads = []
+        # Payload prices as a float column (NaN when missing) so price filters are a vectorised mask
+        self._prices = np.empty(0, dtype=np.float64)
+        self._rows = {}
+        self._hnsw = None
+        self._lock = threading.RLock()
+        self._refreshing = False
+        # One list of pending (method, args) per load in progress
+        self._journals = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ready(self):
+        return self.loaded_at is not None
+
+    def is_stale(self):
+        return self.ready and self.max_age is not None and time.time() - self.loaded_at > self.max_age
+
+    # Until a load succeeds (e.g. Qdrant wasn't up at startup) callers keep retrying it in the
+    # background, at most once every retry_interval seconds
+    def ensure_loaded(self, client, collection_name):
+        if self.ready or time.time() - self._last_attempt < self.retry_interval:
+            return
+        self.refresh_in_background(client, collection_name)
+
+    def load_from_qdrant(self, client, collection_name):
+        self._last_attempt = time.time()
+        ids = []
+        vectors = []
+        payloads = []
+        offset = None
+        start = time.perf_counter()
+        journal = []
+        with self._lock:
+            self._journals.append(journal)
+        try:
+            while True:
+                records, offset = client.scroll(
+                    collection_name=collection_name,
+                    limit=self.SCROLL_BATCH_SIZE,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True,
+                )
+                for record in records:
+                    ids.append(str(record.id))
+                    vectors.append(record.vector)
+                    payloads.append(record.payload or {})
+                if offset is None:
+                    break
+
+            matrix = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+            hnsw = self._build_hnsw(matrix) if self.mode == "hnsw" else None
+            with self._lock:
+                self._matrix = matrix
+                self._ids = ids
+                self._payloads = payloads
+                self._prices = self._price_column(payloads)
+                self._rows = {point_id: row for row, point_id in enumerate(ids)}
+                self._hnsw = hnsw
+                # Both are idempotent, so replaying a change the scroll already saw is harmless
+                for apply, args in journal:
+                    apply(*args)
+                self.loaded_at = time.time()
+        finally:
+            with self._lock:
+                self._journals = [pending for pending in self._journals if pending is not journal]
+        logging.info(f"Loaded {len(ids)} vectors from {collection_name} into {self.mode} index in "
+                     f"{time.perf_counter() - start:.2f}s, replayed {len(journal)} concurrent changes")
+
+    def refresh_in_background(self, client, collection_name):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.load_from_qdrant(client, collection_name)
+            except Exception as e:
+                logging.error(f"Error refreshing vector index: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name="vector-index-refresh", daemon=True).start()
+
+    def upsert(self, ids, vectors, payloads):
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        ids, payloads = list(ids), list(payloads)
+        with self._lock:
+            for journal in self._journals:
+                journal.append((self._apply_upsert, (ids, vectors, payloads)))
+            self._apply_upsert(ids, vectors, payloads)
+
+    def delete(self, ids):
+        ids = list(ids)
+        with self._lock:
+            for journal in self._journals:
+                journal.append((self._apply_delete, (ids,)))
+            self._apply_delete(ids)
+
+    # Callers hold the lock
+    def _apply_upsert(self, ids, vectors, payloads):
+        new_rows = []
+        for point_id, vector, payload in zip(ids, vectors, payloads):
+            point_id = str(point_id)
+            row = self._rows.get(point_id)
+            if row is None:
+                row = len(self._ids) + len(new_rows)
+                self._rows[point_id] = row
+                new_rows.append((point_id, vector, payload))
+            else:
+                self._payloads[row] = payload
+                self._prices[row] = self._price_column([payload])[0]
+                self._matrix[row] = vector
+                if self._hnsw is not None:
+                    self._hnsw.add_items(vector.reshape(1, -1), [row])
+
+        if new_rows:
+            start = len(self._ids)
+            added = np.stack([vector for _, vector, _ in new_rows])
+            # Build a new matrix rather than resizing in place so concurrent searches keep a consistent view
+            self._matrix = np.concatenate([self._matrix, added])
+            self._ids = self._ids + [point_id for point_id, _, _ in new_rows]
+            self._payloads = self._payloads + [payload for _, _, payload in new_rows]
+            self._prices = np.concatenate([self._prices, self._price_column([payload for _, _, payload in new_rows])])
+            if self._hnsw is not None:
+                if self._hnsw.get_max_elements() < len(self._ids):
+                    self._hnsw.resize_index(max(len(self._ids), 2 * self._hnsw.get_max_elements()))
+                self._hnsw.add_items(added, np.arange(start, len(self._ids)))
+
+    def _apply_delete(self, ids):
+        drop = {self._rows[str(point_id)] for point_id in ids if str(point_id) in self._rows}
+        if not drop:
+            return
+        keep = np.array([row for row in range(len(self._ids)) if row not in drop], dtype=np.int64)
+        # Rows shift, so the arrays are rebuilt (and the HNSW graph with them) rather than patched
+        self._matrix = self._matrix[keep]
+        self._ids = [self._ids[row] for row in keep]
+        self._payloads = [self._payloads[row] for row in keep]
+        self._prices = self._prices[keep]
+        self._rows = {point_id: row for row, point_id in enumerate(self._ids)}
+        if self._hnsw is not None:
+            self._hnsw = self._build_hnsw(self._matrix)
+
+    # price_range is (gte, lte) with None for an open end. Filtered searches always scan
+    # the matching rows exactly, since a graph walk could stop before reaching them.
+    def search(self, query_vector, limit=5, price_range=None):
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        with self._lock:
+            matrix, ids, payloads, prices, hnsw = self._matrix, self._ids, self._payloads, self._prices, self._hnsw
+        if not ids:
+            return []
+
+        candidates = None
+        if price_range is not None:
+            gte, lte = price_range
+            mask = ~np.isnan(prices)
+            if gte is not None:
+                mask &= prices >= gte
+            if lte is not None:
+                mask &= prices <= lte
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+
+        if hnsw is not None and candidates is None:
+            labels, distances = hnsw.knn_query(query, k=min(limit, len(ids)))
+            rows = labels[0]
+            scores = 1.0 - distances[0]
+        else:
+            if candidates is None:
+                candidates = np.arange(len(ids))
+            similarities = matrix[candidates] @ query if len(candidates) < len(ids) else matrix @ query
+            limit = min(limit, len(candidates))
+            if limit < len(candidates):
+                top = np.argpartition(-similarities, limit - 1)[:limit]
+            else:
+                top = np.arange(len(candidates))
+            top = top[np.argsort(-similarities[top])]
+            rows = candidates[top]
+            scores = similarities[top]
+
+        return [IndexHit(ids[row], float(score), payloads[row]) for row, score in zip(rows, scores)]
+
+    def _build_hnsw(self, matrix):
+        index = hnswlib.Index(space="cosine", dim=self.dim)
+        index.init_index(max_elements=max(len(matrix), 1024), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+        index.set_ef(self.hnsw_ef)
+        if len(matrix):
+            index.add_items(matrix, np.arange(len(matrix)))
+        return index
+
+    @staticmethod
+    def _price_column(payloads):
+        prices = np.full(len(payloads), np.nan)
+        for row, payload in enumerate(payloads):
+            try:
+                prices[row] = float(payload.get("price"))
+            except (TypeError, ValueError):
+                pass
+        return prices
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
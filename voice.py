@@ -0,0 +1,149 @@
+import asyncio
+import contextvars
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import speech_recognition as sr
+
+SAMPLE_WIDTHS = (1, 2, 4)
+MAX_SAMPLE_RATE = 192000
+
+
+class GoogleRecognizerBackend:
+    def __init__(self, language="en-US"):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def recognize(self, audio: sr.AudioData):
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+
+class SphinxRecognizerBackend:
+    # Fully offline, needs the pocketsphinx package
+    def __init__(self, language="en-US"):
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def recognize(self, audio: sr.AudioData):
+        return self.recognizer.recognize_sphinx(audio, language=self.language)
+
+
+class StaticRecognizerBackend:
+    # Stand-in engine for tests and air-gapped deployments: every clip "says" the configured
+    # transcript, and an empty transcript behaves like audio that could not be understood.
+    def __init__(self, transcript=""):
+        self.transcript = transcript
+
+    def recognize(self, audio: sr.AudioData):
+        if not self.transcript:
+            raise sr.UnknownValueError()
+        return self.transcript
+
+
+def create_recognizer_backend(name=None):
+    name = name or os.getenv("VOICE_RECOGNIZER", "google")
+    language = os.getenv("VOICE_LANGUAGE", "en-US")
+    if name == "google":
+        return GoogleRecognizerBackend(language)
+    if name == "sphinx":
+        return SphinxRecognizerBackend(language)
+    if name == "static":
+        return StaticRecognizerBackend(os.getenv("VOICE_STATIC_TRANSCRIPT", ""))
+    raise ValueError(f"Unknown VOICE_RECOGNIZER: {name}")
+
+
+def decode_audio(data: bytes):
+    # sr.AudioFile accepts any file-like object, so uploads never touch the disk
+    with sr.AudioFile(io.BytesIO(data)) as source:
+        return sr.Recognizer().record(source)
+
+
+class VoicePipeline:
+    # Recognition and assistant calls block, so they run on a small dedicated pool.
+    # The semaphore bounds how many requests may be queued for it at once.
+
+    def __init__(self, backend, max_workers=2, max_pending=8):
+        self.backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="voice")
+        self._slots = asyncio.Semaphore(max_pending)
+
+    async def run(self, func, *args):
+        async with self._slots:
+            # run_in_executor doesn't carry contextvars over, so the request id is copied explicitly
+            return await asyncio.get_running_loop().run_in_executor(self._executor, contextvars.copy_context().run, func, *args)
+
+    async def transcribe(self, data: bytes):
+        return await self.run(self._transcribe, data)
+
+    async def transcribe_pcm(self, pcm: bytes, sample_rate: int, sample_width: int):
+        return await self.run(self.backend.recognize, sr.AudioData(pcm, sample_rate, sample_width))
+
+    def _transcribe(self, data):
+        return self.backend.recognize(decode_audio(data))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Parses client-supplied PCM parameters, raising ValueError for anything that isn't a positive
+# sample rate up to MAX_SAMPLE_RATE and one of the SAMPLE_WIDTHS (bytes per sample)
+def parse_audio_format(sample_rate, sample_width):
+    sample_rate, sample_width = int(sample_rate), int(sample_width)
+    if not 0 < sample_rate <= MAX_SAMPLE_RATE:
+        raise ValueError(f"sample_rate must be between 1 and {MAX_SAMPLE_RATE}, got {sample_rate}")
+    if sample_width not in SAMPLE_WIDTHS:
+        raise ValueError(f"sample_width must be one of {SAMPLE_WIDTHS}, got {sample_width}")
+    return sample_rate, sample_width
+
+
+class StreamingTranscriber:
+    # Accumulates raw mono PCM frames from a client that is still speaking and
+    # re-transcribes the buffer every `partial_interval` seconds of new audio.
+
+    def __init__(self, pipeline, sample_rate=16000, sample_width=2, partial_interval=1.0, max_seconds=60.0):
+        self.pipeline = pipeline
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.bytes_per_second = sample_rate * sample_width
+        self.partial_bytes = int(partial_interval * self.bytes_per_second)
+        self.max_bytes = int(max_seconds * self.bytes_per_second)
+        self.buffer = bytearray()
+        self._last_partial_at = 0
+        self._partial_task = None
+
+    @property
+    def full(self):
+        return len(self.buffer) >= self.max_bytes
+
+    # Returns a task producing the next partial transcript, or None if it isn't time yet
+    def feed(self, frame: bytes):
+        self.buffer.extend(frame[:max(self.max_bytes - len(self.buffer), 0)])
+        if len(self.buffer) - self._last_partial_at < self.partial_bytes:
+            return None
+        # Skip this round if the previous partial is still running rather than piling up work
+        if self._partial_task is not None and not self._partial_task.done():
+            return None
+        self._last_partial_at = len(self.buffer)
+        self._partial_task = asyncio.create_task(self._transcribe())
+        return self._partial_task
+
+    async def finish(self):
+        if self._partial_task is not None and not self._partial_task.done():
+            self._partial_task.cancel()
+        return await self._transcribe(final=True)
+
+    async def _transcribe(self, final=False):
+        # Keep whole samples only
+        usable = len(self.buffer) - len(self.buffer) % self.sample_width
+        try:
+            return await self.pipeline.transcribe_pcm(bytes(self.buffer[:usable]), self.sample_rate, self.sample_width)
+        except sr.UnknownValueError:
+            if final:
+                raise
+            return None
+        except sr.RequestError as e:
+            if final:
+                raise
+            logging.warning(f"Partial transcription failed: {e}")
+            return None